@@ -4,11 +4,25 @@
 支持 YAML 配置文件 + 环境变量 + Azure OpenAI
 """
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from pathlib import Path
+import json
 import yaml
 import os
 
+# 优先使用 libyaml 的 C 解析器（约 5 倍速度），不可用时退回纯 Python 实现
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+# 可选：Aho-Corasick 多模式匹配（一次扫描匹配全部分类关键词）
+try:
+    import ahocorasick
+    HAS_AHOCORASICK = True
+except ImportError:
+    HAS_AHOCORASICK = False
+
 @dataclass
 class QdrantConfig:
     """Qdrant 向量数据库配置"""
@@ -17,10 +31,21 @@ class QdrantConfig:
     collection_name: str = "rag_documents"
     vector_size: int = 1536
     distance_metric: str = "Cosine"
+    # INT8 标量量化：索引内存/带宽降为 1/4，检索时用原始向量重打分
+    scalar_quantization: bool = False
+    upsert_concurrency: int = 4  # 同时在途的 upsert 批次数
+    # gRPC：向量以 protobuf 原始 float 传输，比 REST 的 JSON 小得多（需暴露 6334 端口）
+    prefer_grpc: bool = False
+    grpc_port: int = 6334
+    grpc_compression: bool = False  # gRPC 层 gzip 压缩（带宽受限时开启）
     
     def __post_init__(self):
         self.host = os.getenv('QDRANT_HOST', self.host)
         self.port = int(os.getenv('QDRANT_PORT', self.port))
+        self.grpc_port = int(os.getenv('QDRANT_GRPC_PORT', self.grpc_port))
+        prefer_grpc = os.getenv('QDRANT_PREFER_GRPC')
+        if prefer_grpc is not None:
+            self.prefer_grpc = prefer_grpc.lower() in ('1', 'true', 'yes')
 
 
 @dataclass
@@ -33,6 +58,9 @@ class EmbeddingConfig:
     batch_size: int = 100
     max_retries: int = 3
     timeout: int = 30
+    max_concurrency: int = 1  # 同时在途的 embedding 请求批次数
+    adaptive_batch_size: bool = False  # 从 batch_size 起按成功/400/429 自动放大或缩小批大小
+    near_duplicate_threshold: Optional[float] = None  # 近重复文本复用向量的 Jaccard 阈值（None 关闭）
     
     # Azure OpenAI 专用字段
     azure_endpoint_env: Optional[str] = None
@@ -57,6 +85,8 @@ class ChunkingConfig:
     language: str = "auto"
     use_nltk: bool = True
     use_spacy: bool = True
+    spacy_n_process: int = 1
+    spacy_gpu: bool = False
     use_semantic_chunking: bool = False
 
 
@@ -70,6 +100,7 @@ class CleaningConfig:
     custom_patterns: List[str] = field(default_factory=list)
     use_chardet: bool = True
     default_encoding: str = "utf-8"
+    encoding_sample_size: int = 32768
 
 @dataclass
 class QualityConfig:
@@ -92,9 +123,12 @@ class Category:
     
     def match_score(self, text: str) -> float:
         """计算文本与分类的匹配度"""
+        return self._match_score_lower(text.lower())
+
+    def _match_score_lower(self, text_lower: str) -> float:
+        """同 match_score，但要求调用方已将文本转为小写"""
         if not self.keywords:
             return 0.0
-        text_lower = text.lower()
         matches = sum(1 for kw in self.keywords if kw.lower() in text_lower)
         return matches / len(self.keywords)
 
@@ -108,6 +142,7 @@ class ProcessingConfig:
     show_progress: bool = True
     enable_caching: bool = True
     cache_dir: str = "data/cache"
+    cache_vector_dtype: str = "float32"  # float32 / float16（缓存体积减半）
     replace_existing_source: bool = True
     skip_errors: bool = True
     max_errors: int = 10
@@ -162,8 +197,7 @@ class Settings:
         config_file = Path(self.config_path)
         if config_file.exists():
             try:
-                with open(config_file, 'r', encoding='utf-8') as f:
-                    config = yaml.safe_load(f) or {}
+                config = self._read_config_file(config_file)
             except Exception as e:
                 print(f"⚠️  配置文件加载失败: {e}")
                 print(f"   使用默认配置")
@@ -189,6 +223,96 @@ class Settings:
             self.categories = [
                 Category(name="general", keywords=[], description="默认分类")
             ]
+
+        self._build_keyword_matcher()
+
+    @staticmethod
+    def _read_config_file(config_file: Path) -> Dict:
+        """
+        读取 YAML 配置，并以 JSON 快照缓存解析结果
+
+        快照与配置文件同目录（.<name>.cache.json），按 mtime/size 校验；
+        命中时直接 json.load，跳过 YAML 解析。快照读写失败不影响加载。
+        """
+        stat = config_file.stat()
+        stamp = [stat.st_mtime_ns, stat.st_size]
+        snapshot = config_file.with_name(f".{config_file.name}.cache.json")
+
+        try:
+            with open(snapshot, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('stamp') == stamp:
+                return cached['config']
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+        with open(config_file, 'r', encoding='utf-8') as f:
+            config = yaml.load(f, Loader=SafeLoader) or {}
+
+        try:
+            payload = json.dumps({'stamp': stamp, 'config': config}, ensure_ascii=False)
+            # 非字符串键等无法无损往返 JSON 的配置不缓存
+            if json.loads(payload)['config'] == config:
+                tmp = snapshot.with_name(f"{snapshot.name}.{os.getpid()}.tmp")
+                tmp.write_text(payload, encoding='utf-8')
+                os.replace(tmp, snapshot)
+        except (OSError, TypeError, ValueError):
+            # 只读目录或含 JSON 不支持的类型（如日期）时不缓存
+            pass
+
+        return config
+
+    def _build_keyword_matcher(self):
+        """
+        将所有分类的关键词编译为一个 Aho-Corasick 自动机
+
+        每个小写关键词映射到 (分类下标, 关键词下标) 列表，
+        同一关键词出现在多个分类中时只需匹配一次。
+        未安装 pyahocorasick 时退回逐关键词子串查找。
+        """
+        self._keyword_automaton = None
+        self._empty_keyword_refs: List[Tuple[int, int]] = []
+
+        if not HAS_AHOCORASICK:
+            return
+
+        owners: Dict[str, List[Tuple[int, int]]] = {}
+        for ci, category in enumerate(self.categories):
+            for ki, kw in enumerate(category.keywords):
+                word = kw.lower()
+                if word:
+                    owners.setdefault(word, []).append((ci, ki))
+                else:
+                    # 空关键词与原实现一致：恒为命中
+                    self._empty_keyword_refs.append((ci, ki))
+
+        if not owners:
+            return
+
+        automaton = ahocorasick.Automaton()
+        for word, refs in owners.items():
+            automaton.add_word(word, tuple(refs))
+        automaton.make_automaton()
+        self._keyword_automaton = automaton
+
+    def _category_scores(self, text_lower: str) -> List[float]:
+        """一次扫描计算所有分类的匹配度（与 Category.match_score 结果一致）"""
+        if self._keyword_automaton is None:
+            return [cat._match_score_lower(text_lower) for cat in self.categories]
+
+        # 每个关键词只计一次，与原 `kw in text` 语义一致
+        matched = set(self._empty_keyword_refs)
+        for _, refs in self._keyword_automaton.iter(text_lower):
+            matched.update(refs)
+
+        hits = [0] * len(self.categories)
+        for ci, _ in matched:
+            hits[ci] += 1
+
+        return [
+            hits[ci] / len(cat.keywords) if cat.keywords else 0.0
+            for ci, cat in enumerate(self.categories)
+        ]
             
     def get_category_by_name(self, name: str) -> Optional[Category]:
         """根据名称获取分类"""
@@ -201,9 +325,10 @@ class Settings:
         """根据文本内容自动分类"""
         best_category = None
         best_score = 0.0
+
+        scores = self._category_scores(text.lower())
         
-        for category in self.categories:
-            score = category.match_score(text)
+        for category, score in zip(self.categories, scores):
             if score > best_score:
                 best_score = score
                 best_category = category
@@ -251,6 +376,8 @@ class Settings:
         
         print("\n🗄️  Qdrant:")
         print(f"   Host: {self.qdrant.host}:{self.qdrant.port}")
+        if self.qdrant.prefer_grpc:
+            print(f"   gRPC Port: {self.qdrant.grpc_port}")
         print(f"   Collection: {self.qdrant.collection_name}")
         print(f"   Vector Size: {self.qdrant.vector_size}")
         
@@ -276,12 +403,20 @@ class Settings:
 # 全局单例
 _settings = None
 
+
+def _same_config(loaded_path: str, target_path: str) -> bool:
+    """判断两个配置路径是否指向同一文件"""
+    if loaded_path == target_path:
+        return True
+    return os.path.abspath(loaded_path) == os.path.abspath(target_path)
+
 def get_settings(config_path: str = None) -> Settings:
     """获取全局配置实例（单例模式）"""
     global _settings
     
     target_path = config_path or "config/config_azure.yaml"
-    if _settings is None or _settings.config_path != target_path:
+    # 同一文件的不同写法（相对/绝对路径、./ 前缀）复用同一实例
+    if _settings is None or not _same_config(_settings.config_path, target_path):
         _settings = Settings(target_path)
         
     return _settings
@@ -14,11 +14,13 @@ import sys
 import time
 import logging
 import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient
+from qdrant_client.models import QuantizationSearchParams, SearchParams
 
 load_dotenv(Path(__file__).parent / ".env")
 sys.path.insert(0, str(Path(__file__).parent / "src"))
@@ -37,6 +39,8 @@ RERANKER_MODEL  = "BAAI/bge-reranker-v2-m3"   # 支持中英文，~2.3GB
 RECALL_MULT     = 3    # 召回倍数：top_k=5 时召回 15 个候选（从 20 降到 15）
 MIN_SCORE       = 0.0  # 向量检索阶段最低分
 RERANKER_MAX_LEN = 256 # 中文语义密度高，256 token ≈ 200+ 字，截断影响极小
+# 集合启用 INT8 量化时用原始向量对候选重打分；未量化的集合会忽略该参数
+SEARCH_PARAMS   = SearchParams(quantization=QuantizationSearchParams(rescore=True))
 PROJECT_ROOT = Path(__file__).parent.resolve()
 QUERY_CACHE_DIR = PROJECT_ROOT / "data/query_cache"
 
@@ -94,6 +98,91 @@ def get_reranker():
     return _reranker
 
 
+# ──────────────────────────────────────────────
+# Query Embedding 缓存（进程内 LRU + 磁盘缓存）
+# ──────────────────────────────────────────────
+_qdrant = None
+_embedder = None
+_query_cache = None
+
+def get_qdrant() -> QdrantClient:
+    """
+    进程内复用同一个 Qdrant 客户端（连接池随之复用）。
+    QDRANT_PREFER_GRPC=1 时走 gRPC（需暴露 6334 端口），protobuf 比 JSON 更小更快。
+    """
+    global _qdrant
+    if _qdrant is None:
+        prefer_grpc = os.getenv("QDRANT_PREFER_GRPC", "").lower() in ("1", "true", "yes")
+        _qdrant = QdrantClient(
+            host=os.getenv("QDRANT_HOST", "localhost"),
+            port=int(os.getenv("QDRANT_PORT", "6333")),
+            grpc_port=int(os.getenv("QDRANT_GRPC_PORT", "6334")),
+            prefer_grpc=prefer_grpc,
+        )
+    return _qdrant
+
+
+def get_embedder() -> AzureOpenAIEmbedding:
+    global _embedder
+    if _embedder is None:
+        _embedder = AzureOpenAIEmbedding()
+    return _embedder
+
+
+def get_query_cache() -> DiskCache:
+    global _query_cache
+    if _query_cache is None:
+        _query_cache = DiskCache(str(QUERY_CACHE_DIR))
+    return _query_cache
+
+
+@lru_cache(maxsize=1024)
+def _embed_query_cached(query: str) -> tuple:
+    """
+    进程内缓存 query embedding（eval 批量评估时重复查询直接命中）。
+    未命中时先查磁盘缓存（跨进程持久化），再调用 Azure。
+    返回 tuple 以保证缓存值不可变。
+    """
+    embedder = get_embedder()
+    query_cache = get_query_cache()
+    namespace = _query_cache_namespace(embedder)
+
+    query_vector = query_cache.get(query, namespace=namespace)
+    if query_vector is None:
+        query_vector = embedder.embed(query)
+        query_cache.set(query, query_vector, namespace=namespace)
+    return tuple(query_vector)
+
+
+def _query_cache_namespace(embedder: AzureOpenAIEmbedding) -> str:
+    return f"query_embedding:{embedder.deployment_name}:{embedder.api_version}"
+
+
+def prefetch_query_embeddings(queries: list[str]) -> int:
+    """
+    批量预取 query embedding：把所有未缓存的查询合并成批量请求，
+    而不是每条查询各发一次 Azure 请求。结果写入磁盘缓存，供 search() 命中。
+
+    Returns:
+        实际调用 Azure 生成的 embedding 数量
+    """
+    embedder = get_embedder()
+    query_cache = get_query_cache()
+    namespace = _query_cache_namespace(embedder)
+
+    missing = [
+        q for q in dict.fromkeys(queries)
+        if query_cache.get(q, namespace=namespace) is None
+    ]
+    if not missing:
+        return 0
+
+    embeddings = embedder.embed_batch(missing, show_progress=False)
+    for q, emb in zip(missing, embeddings):
+        query_cache.set(q, emb, namespace=namespace)
+    return len(missing)
+
+
 # ──────────────────────────────────────────────
 # 核心查询函数
 # ──────────────────────────────────────────────
@@ -115,46 +204,38 @@ def search(
     Returns:
         结果列表，每项包含 text / source / score / rerank_score
     """
-    qdrant_host = os.getenv("QDRANT_HOST", "localhost")
-    qdrant_port = int(os.getenv("QDRANT_PORT", "6333"))
-    qdrant   = QdrantClient(host=qdrant_host, port=qdrant_port)
-    embedder = AzureOpenAIEmbedding()
-    query_cache = DiskCache(str(QUERY_CACHE_DIR))
-    query_cache_namespace = (
-        f"query_embedding:{embedder.deployment_name}:{embedder.api_version}"
-    )
+    qdrant = get_qdrant()
 
     total_start = time.time()
 
     # ── Stage 1: 向量检索 ──────────────────────
     t0 = time.time()
-    query_vector = query_cache.get(query, namespace=query_cache_namespace)
-    if query_vector is None:
-        query_vector = embedder.embed(query)
-        query_cache.set(query, query_vector, namespace=query_cache_namespace)
+    query_vector = list(_embed_query_cached(query))
     embed_time   = time.time() - t0
 
     recall_n = top_k * RECALL_MULT if use_rerank else top_k
 
     t0 = time.time()
     # qdrant-client >= 1.10 用 query_points()，旧版用 search()
-    try:
-        from qdrant_client.models import QueryRequest
+    # 两者都走服务端 HNSW 索引，只返回 top-N payload，不回传向量
+    if hasattr(qdrant, "query_points"):
         response = qdrant.query_points(
             collection_name=COLLECTION,
             query=query_vector,
             limit=recall_n,
             score_threshold=MIN_SCORE,
+            search_params=SEARCH_PARAMS,
             with_payload=True,
             with_vectors=False,
         )
         hits = response.points
-    except AttributeError:
+    else:
         hits = qdrant.search(
             collection_name=COLLECTION,
             query_vector=query_vector,
             limit=recall_n,
             score_threshold=MIN_SCORE,
+            search_params=SEARCH_PARAMS,
             with_payload=True,
             with_vectors=False,
         )
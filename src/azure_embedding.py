@@ -3,20 +3,184 @@
 Azure OpenAI Embedding 客户端 - 加强验证版
 """
 import os
-from typing import List, Union
+import functools
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 from pathlib import Path
 import time
 import logging
 import re
+import zlib
+
+# 可选：orjson 解析 embedding 响应（数千个浮点数/条，约为标准库 json 的 3 倍速度）
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
 
 logger = logging.getLogger("AzureEmbedding")
 
+# 需要删除的控制字符：\x00-\x08、\x0b、\x0c、\x0e-\x1f、\x7f
+_CONTROL_CHARS_TABLE = dict.fromkeys(
+    [*range(0x00, 0x09), 0x0b, 0x0c, *range(0x0e, 0x20), 0x7f]
+)
+
 from dotenv import load_dotenv
 project_root = Path(__file__).parent.parent
 load_dotenv(project_root / ".env")
 
 
+class _AdaptiveLimiter:
+    """
+    AIMD 自适应并发上限（线程安全，用作 with 上下文）
+
+    429/5xx 时上限减半，连续成功 limit 次后上限 +1（不超过 max_limit），
+    使在途请求数收敛到服务端实际可承受的水平，而不是固定窗口的突发/空闲交替。
+    """
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self._in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self._in_flight >= self.limit:
+                self._cond.wait()
+            self._in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+        return False
+
+    def on_success(self):
+        with self._cond:
+            self._successes += 1
+            if self.limit < self.max_limit and self._successes >= self.limit:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    def on_throttle(self):
+        with self._cond:
+            new_limit = max(1, self.limit // 2)
+            if new_limit < self.limit:
+                logger.info(f"⏱️  并发上限下调: {self.limit} -> {new_limit}")
+            self.limit = new_limit
+            self._successes = 0
+
+
+class _BatchSizeTuner:
+    """
+    自适应批大小（线程安全）
+
+    连续成功 grow_after 个批次后翻倍（不超过 max_size），遇到 400/429 减半，
+    短文本语料可以用更少的请求数完成。
+    """
+
+    def __init__(self, initial: int, max_size: int = 256, grow_after: int = 5):
+        self.max_size = max(1, max_size)
+        self.grow_after = grow_after
+        self._size = max(1, min(initial, self.max_size))
+        self._streak = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def on_success(self):
+        with self._lock:
+            self._streak += 1
+            if self._streak >= self.grow_after and self._size < self.max_size:
+                self._size = min(self._size * 2, self.max_size)
+                self._streak = 0
+
+    def on_failure(self):
+        with self._lock:
+            self._size = max(1, self._size // 2)
+            self._streak = 0
+
+
+class NearDuplicateIndex:
+    """
+    近重复文本索引（字符 shingle MinHash + LSH 分桶）
+
+    只改了标点、空白或个别错字的文本与已 embedding 的文本 Jaccard 相似度很高，
+    可直接复用其向量而不调用 API。索引只存在于进程内。
+    """
+
+    _PRIME = (1 << 61) - 1
+    _NORMALIZE_RE = re.compile(r'[\W_]+')
+
+    def __init__(self, threshold: float = 0.9, num_perm: int = 64, bands: int = 16,
+                 shingle_size: int = 5, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, self._PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, self._PRIME, size=num_perm, dtype=np.uint64)
+        self._buckets: Dict[tuple, List[int]] = {}
+        self._signatures: List[np.ndarray] = []
+        self._embeddings: List[List[float]] = []
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash 签名（忽略大小写、标点和空白差异）"""
+        norm = self._NORMALIZE_RE.sub('', text.lower()) or text
+        k = self.shingle_size
+        shingles = {norm[i:i + k] for i in range(max(1, len(norm) - k + 1))}
+        hashes = np.fromiter(
+            (zlib.crc32(sh.encode('utf-8')) for sh in shingles),
+            dtype=np.uint64, count=len(shingles),
+        )
+        # (a*h + b) mod p：a < 2^61、h < 2^32，uint64 乘法会回绕，但对哈希族足够
+        permuted = (hashes[:, None] * self._a + self._b) % np.uint64(self._PRIME)
+        return permuted.min(axis=0)
+
+    def _band_keys(self, sig: np.ndarray):
+        for band in range(self.bands):
+            start = band * self.rows
+            yield (band, sig[start:start + self.rows].tobytes())
+
+    def lookup(self, sig: np.ndarray) -> Optional[List[float]]:
+        """返回估计 Jaccard 相似度 ≥ threshold 的最相似文本的 embedding"""
+        candidates = set()
+        for key in self._band_keys(sig):
+            candidates.update(self._buckets.get(key, ()))
+        best, best_sim = None, self.threshold
+        for idx in candidates:
+            sim = float(np.mean(self._signatures[idx] == sig))
+            if sim >= best_sim:
+                best, best_sim = idx, sim
+        return None if best is None else self._embeddings[best]
+
+    def add(self, sig: np.ndarray, embedding: List[float]):
+        idx = len(self._signatures)
+        self._signatures.append(sig)
+        self._embeddings.append(embedding)
+        for key in self._band_keys(sig):
+            self._buckets.setdefault(key, []).append(idx)
+
+    def __len__(self):
+        return len(self._signatures)
+
+
 class AzureOpenAIEmbedding:
     """Azure OpenAI Embedding 客户端"""
     
@@ -30,8 +194,19 @@ class AzureOpenAIEmbedding:
         timeout: int = 60,
         batch_size: int = 20,
         model: str = None,
+        near_duplicate_threshold: Optional[float] = None,
+        max_concurrency: int = 1,
+        adaptive_batch_size: bool = False,
         **kwargs
     ):
+        """
+        Args:
+            max_concurrency: embed_batch 同时在途的请求批次数（线程池，1 为串行）
+            adaptive_batch_size: embed_batch 未显式指定 batch_size 时，
+                从 batch_size 起按成功/400/429 自动放大或缩小批大小
+            near_duplicate_threshold: 可选，MinHash 估计的 Jaccard 相似度阈值；
+                设置后本进程内已 embedding 过的近重复文本直接复用向量（会牺牲少量精度）
+        """
         self.endpoint = endpoint or os.getenv('AZURE_OPENAI_ENDPOINT')
         self.api_key = api_key or os.getenv('AZURE_OPENAI_API_KEY')
         self.deployment_name = deployment_name or os.getenv('AZURE_EMBEDDING_DEPLOYMENT')
@@ -39,6 +214,9 @@ class AzureOpenAIEmbedding:
         self.max_retries = max_retries
         self.timeout = timeout
         self.default_batch_size = batch_size
+        self.max_concurrency = max(1, max_concurrency)
+        self._limiter = _AdaptiveLimiter(self.max_concurrency)
+        self._batch_tuner = _BatchSizeTuner(batch_size) if adaptive_batch_size else None
         
         if not all([self.endpoint, self.api_key, self.deployment_name]):
             raise ValueError("❌ 缺少必需的环境变量")
@@ -49,6 +227,22 @@ class AzureOpenAIEmbedding:
             "api-key": self.api_key
         }
         
+        # 复用 keep-alive 连接，避免每个请求重新做 TCP + TLS 握手；
+        # 连接池大小与并发批次数匹配
+        pool_size = max(10, self.max_concurrency)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        
+        self.near_duplicates = (
+            NearDuplicateIndex(near_duplicate_threshold)
+            if near_duplicate_threshold is not None else None
+        )
+        # 单文本 embedding 的进程内 LRU（页眉页脚等重复文本、test_connection、逐条回退）
+        self._embed_single_cached = functools.lru_cache(maxsize=1024)(self._embed_single_raw)
+        
         logger.info(f"✅ Azure OpenAI 客户端初始化")
         logger.info(f"   Endpoint: {self.endpoint}")
         logger.info(f"   Deployment: {self.deployment_name}")
@@ -66,8 +260,8 @@ class AzureOpenAIEmbedding:
         if not text or not text.strip():
             return "empty"
         
-        # 移除 null 字符和其他控制字符
-        text = re.sub(r'[\x00-\x08\x0b-\x0c\x0e-\x1f\x7f]', '', text)
+        # 移除 null 字符和其他控制字符（保留 \t \n \r）
+        text = text.translate(_CONTROL_CHARS_TABLE)
         
         # 截断过长文本
         # text-embedding-3-large: 8191 tokens ≈ 32,000 字符
@@ -81,58 +275,77 @@ class AzureOpenAIEmbedding:
         return text if text else "empty"
     
     def embed(self, text: Union[str, List[str]]) -> Union[List[float], List[List[float]]]:
-        """生成 embedding - 带验证"""
-        is_single = isinstance(text, str)
-        texts = [text] if is_single else text
+        """生成 embedding - 带验证（单个文本走进程内 LRU 缓存）"""
+        if isinstance(text, str):
+            return self._embed_single_cached(self.validate_and_clean_text(text)).tolist()
         
         # 验证和清理所有文本
-        texts = [self.validate_and_clean_text(t) for t in texts]
-        
+        return self._request_embeddings([self.validate_and_clean_text(t) for t in text])
+    
+    def _embed_single_raw(self, cleaned_text: str) -> np.ndarray:
+        """请求单个文本的 embedding；以只读 float32 数组缓存，约为 Python float 列表的 1/8 内存"""
+        vec = np.asarray(self._request_embeddings([cleaned_text])[0], dtype=np.float32)
+        vec.flags.writeable = False
+        return vec
+    
+    def cache_info(self):
+        """单文本 LRU 缓存的命中统计（functools 的 CacheInfo）"""
+        return self._embed_single_cached.cache_info()
+    
+    def _request_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """调用 Azure OpenAI embeddings 接口（texts 需已清洗），带重试"""
         payload = {"input": texts}
         
         for attempt in range(self.max_retries):
             try:
-                response = requests.post(
-                    self.url,
-                    headers=self.headers,
-                    json=payload,
-                    timeout=self.timeout
-                )
+                with self._limiter:
+                    response = self.session.post(
+                        self.url,
+                        json=payload,
+                        timeout=self.timeout
+                    )
+                
+                if response.status_code == 429 or response.status_code >= 500:
+                    self._limiter.on_throttle()
+                elif response.ok:
+                    self._limiter.on_success()
                 
                 if response.status_code == 429:
-                    retry_after = int(response.headers.get('Retry-After', 10))
-                    logger.warning(f"⚠️  速率限制，等待 {retry_after} 秒...")
-                    time.sleep(retry_after)
+                    if attempt == self.max_retries - 1:
+                        # 交给 embed_batch 的 429 分支处理（等待后整批重试）
+                        raise requests.exceptions.HTTPError(
+                            "429 rate limit: max retries exceeded", response=response
+                        )
+                    wait = self._compute_backoff(attempt, response)
+                    logger.warning(f"⚠️  速率限制，等待 {wait:.1f} 秒...")
+                    time.sleep(wait)
                     continue
                 
-                # 如果是 400 错误，记录详细信息
-                if response.status_code == 400:
-                    logger.error(f"❌ 400 错误详情:")
-                    logger.error(f"   响应: {response.text[:500]}")
-                    logger.error(f"   文本数量: {len(texts)}")
-                    logger.error(f"   文本长度: {[len(t) for t in texts]}")
-                
                 response.raise_for_status()
                 
-                data = response.json()
-                embeddings = [item['embedding'] for item in data['data']]
-                
-                return embeddings[0] if is_single else embeddings
+                data = orjson.loads(response.content) if HAS_ORJSON else response.json()
+                return [item['embedding'] for item in data['data']]
                 
             except requests.exceptions.HTTPError as e:
-                if response.status_code == 429:
-                    retry_after = int(response.headers.get('Retry-After', 10))
-                    time.sleep(retry_after)
-                    if attempt < self.max_retries - 1:
-                        continue
-                
                 logger.error(f"❌ HTTP 错误: {e}")
-                if attempt == self.max_retries - 1:
+                status = e.response.status_code if e.response is not None else None
+                
+                # 400 错误记录详细信息（只在出错时读取响应体、统计文本长度）
+                if status == 400:
+                    logger.error("❌ 400 错误详情:")
+                    logger.error("   响应: %r", e.response.content[:500])
+                    logger.error("   文本数量: %d", len(texts))
+                    if logger.isEnabledFor(logging.ERROR):
+                        logger.error("   文本长度: %s", [len(t) for t in texts])
+                
+                # 4xx（429 除外）重试也不会成功，直接交给调用方（embed_batch 会逐条回退）
+                if attempt == self.max_retries - 1 or (status is not None and status < 500):
                     raise
+                time.sleep(self._compute_backoff(attempt, e.response))
             
             except Exception as e:
                 if attempt < self.max_retries - 1:
-                    wait = 2 ** attempt
+                    wait = self._compute_backoff(attempt)
                     logger.warning(f"⚠️  尝试 {attempt + 1}/{self.max_retries}: {e}")
                     time.sleep(wait)
                 else:
@@ -140,13 +353,119 @@ class AzureOpenAIEmbedding:
         
         raise Exception("Max retries exceeded")
     
+    @staticmethod
+    def _compute_backoff(attempt: int, response=None, cap: float = 60.0) -> float:
+        """
+        重试等待秒数：优先使用服务端的 retry-after-ms / Retry-After，
+        否则为带随机抖动的指数退避（上限 cap），避免并发请求同步重试
+        """
+        if response is not None:
+            for header, scale in (('retry-after-ms', 0.001), ('Retry-After', 1.0)):
+                value = response.headers.get(header)
+                if value:
+                    try:
+                        return max(0.0, float(value) * scale)
+                    except ValueError:
+                        # Retry-After 也可能是 HTTP 日期格式，退回指数退避
+                        pass
+        return min(cap, random.uniform(1, 2 ** attempt * 2))
+    
     def embed_batch(
         self,
         texts: List[str],
         batch_size: int = None,
-        show_progress: bool = True
-    ) -> List[List[float]]:
-        """批量生成 embeddings"""
+        show_progress: bool = True,
+        as_numpy: bool = False
+    ) -> Union[List[List[float]], np.ndarray]:
+        """
+        批量生成 embeddings（启用近重复复用时只请求未命中的文本）
+
+        as_numpy=True 时返回 (len(texts), dim) 的 float32 矩阵，
+        内存约为 List[List[float]] 的 1/8，便于直接做向量运算。
+        """
+        # 空白文本的 embedding 是确定的（都清洗为 "empty"），只请求一次
+        blank = [i for i, t in enumerate(texts) if not t or not t.strip()]
+        if blank:
+            return self._embed_batch_with_blanks(texts, blank, batch_size, show_progress, as_numpy)
+        
+        if self.near_duplicates is None:
+            return self._embed_batch_uncached(texts, batch_size, show_progress, as_numpy)
+        
+        # 以清洗后的文本为键，去重后再查近重复索引
+        keys = [self.validate_and_clean_text(t) for t in texts]
+        found = {}
+        signatures = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            sig = self.near_duplicates.signature(key)
+            reused = self.near_duplicates.lookup(sig)
+            if reused is not None:
+                found[key] = reused
+            else:
+                signatures[key] = sig
+                missing.append(key)
+        if found:
+            logger.info(f"♻️  近重复复用: {len(found)} 个文本")
+        
+        if missing:
+            new_embeddings = self._embed_batch_uncached(missing, batch_size, show_progress)
+            for key, emb in zip(missing, new_embeddings):
+                self.near_duplicates.add(signatures[key], emb)
+                found[key] = emb
+        
+        return self._collect(found, keys, as_numpy)
+    
+    def _embed_batch_with_blanks(
+        self,
+        texts: List[str],
+        blank: List[int],
+        batch_size: Optional[int],
+        show_progress: bool,
+        as_numpy: bool
+    ) -> Union[List[List[float]], np.ndarray]:
+        """只为非空白文本调用 embed_batch，空白文本共用 embed("empty") 的结果（单文本 LRU）"""
+        blank_set = set(blank)
+        non_blank = [t for i, t in enumerate(texts) if i not in blank_set]
+        empty_vec = self.embed("empty")
+        embedded = (
+            self.embed_batch(non_blank, batch_size, show_progress, as_numpy=as_numpy)
+            if non_blank else []
+        )
+        
+        if as_numpy:
+            out = np.empty((len(texts), len(empty_vec)), dtype=np.float32)
+            out[blank] = empty_vec
+            if non_blank:
+                mask = np.ones(len(texts), dtype=bool)
+                mask[blank] = False
+                out[mask] = embedded
+            return out
+        
+        embedded_iter = iter(embedded)
+        # 每个空白位置各自一份列表，调用方原地修改某个向量不会影响其它位置
+        return [
+            list(empty_vec) if i in blank_set else next(embedded_iter)
+            for i in range(len(texts))
+        ]
+    
+    @staticmethod
+    def _collect(embeddings_by_key: Dict, keys: List[str], as_numpy: bool):
+        """按 keys 顺序组装结果"""
+        if not as_numpy:
+            return [embeddings_by_key[k] for k in keys]
+        if not keys:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.array([embeddings_by_key[k] for k in keys], dtype=np.float32)
+    
+    def _embed_batch_uncached(
+        self,
+        texts: List[str],
+        batch_size: int = None,
+        show_progress: bool = True,
+        as_numpy: bool = False
+    ) -> Union[List[List[float]], np.ndarray]:
+        """批量生成 embeddings（逐批请求 API；as_numpy 时直接写入预分配的 float32 矩阵）"""
+        tuner = self._batch_tuner if batch_size is None else None
         if batch_size is None:
             batch_size = self.default_batch_size
         
@@ -160,67 +479,114 @@ class AzureOpenAIEmbedding:
                 return items
         
         all_embeddings = []
-        batches = list(batch_iterator(texts, batch_size))
+        failed_count = 0
+        
+        # 批次按需惰性生成，_ordered_map 按提交顺序返回，结果顺序与输入一致
+        if tuner is not None:
+            # 批大小在生成下一批时才读取，批数事先未知
+            results = self._ordered_map(self._iter_tuned_batches(texts, tuner))
+            total = None
+        else:
+            results = self._ordered_map(batch_iterator(texts, batch_size))
+            total = (len(texts) + batch_size - 1) // batch_size
         
         iterator = progress_bar(
-            batches,
+            results,
             desc="Embedding",
-            total=len(batches),
+            total=total,
             disable=not show_progress
         )
         
-        request_count = 0
-        start_minute = time.time()
-        failed_count = 0
+        out = None
+        offset = 0
         
-        for i, batch in enumerate(iterator):
-            if request_count >= 50:
-                elapsed = time.time() - start_minute
-                if elapsed < 60:
-                    wait = 60 - elapsed + 5
-                    logger.info(f"⏱️  速率保护: 等待 {wait:.0f} 秒...")
-                    time.sleep(wait)
-                    start_minute = time.time()
-                    request_count = 0
-            
-            try:
-                embeddings = self.embed(batch)
+        for embeddings, failed in iterator:
+            failed_count += failed
+            if not as_numpy:
                 all_embeddings.extend(embeddings)
-                request_count += 1
-                time.sleep(2.0)
-                
-            except Exception as e:
-                error_msg = str(e).lower()
-                
-                if "rate limit" in error_msg or "429" in error_msg:
-                    logger.warning(f"⚠️  速率限制，等待 30 秒...")
-                    time.sleep(30)
-                    try:
-                        embeddings = self.embed(batch)
-                        all_embeddings.extend(embeddings)
-                    except:
-                        logger.error(f"❌ 批次 {i+1} 重试失败")
-                        failed_count += 1
-                
-                elif "400" in error_msg or "model_error" in error_msg:
-                    logger.error(f"❌ 批次 {i+1} 有问题，尝试单独处理...")
-                    # 单独处理每个文本
-                    for text in batch:
-                        try:
-                            emb = self.embed(text)
-                            all_embeddings.append(emb)
-                            time.sleep(1)
-                        except:
-                            logger.error(f"❌ 单个文本也失败")
-                            failed_count += 1
-                else:
-                    raise
+            elif embeddings:
+                # 维度在第一个批次返回后才知道
+                if out is None:
+                    out = np.empty((len(texts), len(embeddings[0])), dtype=np.float32)
+                out[offset:offset + len(embeddings)] = embeddings
+                offset += len(embeddings)
         
         if failed_count > 0:
             raise RuntimeError(f"Embedding 失败文本块数量: {failed_count}")
         
+        if as_numpy:
+            return out if out is not None else np.empty((0, 0), dtype=np.float32)
         return all_embeddings
     
+    @staticmethod
+    def _iter_tuned_batches(texts: List[str], tuner: _BatchSizeTuner) -> Iterator[List[str]]:
+        """按 tuner 当前批大小逐批切分"""
+        pos = 0
+        while pos < len(texts):
+            size = tuner.size
+            yield texts[pos:pos + size]
+            pos += size
+    
+    def _ordered_map(self, batches: Iterator[List[str]]):
+        """
+        并发执行 _embed_one_batch 并按提交顺序产出结果；
+        最多 max_concurrency 个批次在途，批次生成器按需取下一批
+        """
+        if self.max_concurrency <= 1:
+            for i, batch in enumerate(batches):
+                yield self._embed_one_batch(i, batch)
+            return
+        
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            pending = deque()
+            for i, batch in enumerate(batches):
+                pending.append(executor.submit(self._embed_one_batch, i, batch))
+                if len(pending) >= self.max_concurrency:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    
+    def _embed_one_batch(self, i: int, batch: List[str]) -> Tuple[List[List[float]], int]:
+        """请求一个批次，返回 (embeddings, 失败数)；429/400 时按原策略重试或逐条处理"""
+        tuner = self._batch_tuner
+        try:
+            embeddings = self.embed(batch)
+            if tuner is not None:
+                tuner.on_success()
+            return embeddings, 0
+            
+        except Exception as e:
+            error_msg = str(e).lower()
+            
+            if tuner is not None and any(
+                marker in error_msg for marker in ("rate limit", "429", "400", "model_error")
+            ):
+                tuner.on_failure()
+            
+            if "rate limit" in error_msg or "429" in error_msg:
+                logger.warning(f"⚠️  速率限制，等待 30 秒...")
+                time.sleep(30)
+                try:
+                    return self.embed(batch), 0
+                except:
+                    logger.error(f"❌ 批次 {i+1} 重试失败")
+                    return [], 1
+            
+            elif "400" in error_msg or "model_error" in error_msg:
+                logger.error(f"❌ 批次 {i+1} 有问题，尝试单独处理...")
+                # 单独处理每个文本
+                embeddings = []
+                failed = 0
+                for text in batch:
+                    try:
+                        embeddings.append(self.embed(text))
+                    except:
+                        logger.error(f"❌ 单个文本也失败")
+                        failed += 1
+                return embeddings, failed
+            else:
+                raise
+    
     def test_connection(self) -> bool:
         """测试连接"""
         try:
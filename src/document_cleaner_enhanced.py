@@ -7,21 +7,30 @@
 3. 为每个chunk添加特定的chunk_summary
 """
 import re
-from typing import List, Dict, Optional
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import accumulate
+
+import numpy as np
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from bs4 import BeautifulSoup
 from pathlib import Path
 
 # 可选导入
 try:
-    import chardet
+    # faust-cchardet 是 C 扩展，接口与 chardet 兼容且快数倍
+    import cchardet as chardet
     HAS_CHARDET = True
 except ImportError:
-    HAS_CHARDET = False
-    print("⚠️ chardet未安装，使用UTF-8编码（可能出现乱码）")
+    try:
+        import chardet
+        HAS_CHARDET = True
+    except ImportError:
+        HAS_CHARDET = False
+        print("⚠️ chardet未安装，使用UTF-8编码（可能出现乱码）")
 
 try:
     import nltk
-    from nltk.tokenize import sent_tokenize
     HAS_NLTK = False
     try:
         nltk.data.find('tokenizers/punkt')
@@ -34,22 +43,125 @@ except ImportError:
 
 try:
     import spacy
+    from spacy.attrs import LENGTH, ORTH, POS
+    from spacy.parts_of_speech import NOUN, PROPN
     HAS_SPACY = True
-    try:
-        nlp_zh = spacy.load("zh_core_web_sm")
-        nlp_en = spacy.load("en_core_web_sm")
-        print("✅ spaCy模型已加载（中文+英文）")
-    except OSError:
-        print("⚠️ spaCy模型未安装")
-        HAS_SPACY = False
-        nlp_zh = None
-        nlp_en = None
 except ImportError:
     HAS_SPACY = False
-    nlp_zh = None
-    nlp_en = None
     print("⚠️ spaCy未安装，无法使用NLP功能")
 
+SPACY_MODELS = {
+    'zh': "zh_core_web_sm",
+    'en': "en_core_web_sm",
+}
+
+# GPU 可用时优先使用的 transformer 模型（未安装则回退到 SPACY_MODELS）
+SPACY_TRF_MODELS = {
+    'zh': "zh_core_web_trf",
+    'en': "en_core_web_trf",
+}
+
+_SPACY_ON_GPU = False
+
+
+def enable_spacy_gpu() -> bool:
+    """
+    尝试让 spaCy 在 GPU 上运行（需 CUDA 版 cupy/thinc，无 GPU 时不报错）。
+
+    必须在首次加载模型之前调用；启用成功后 _get_nlp 优先加载 *_trf 模型。
+    返回是否已启用 GPU。
+    """
+    global _SPACY_ON_GPU
+    if not HAS_SPACY:
+        return False
+    if not _SPACY_ON_GPU and spacy.prefer_gpu():
+        _SPACY_ON_GPU = True
+        # 丢弃已在 CPU 上加载的模型，下次使用时按 GPU 配置重新加载
+        _get_nlp.cache_clear()
+        print("✅ spaCy 已启用 GPU")
+    return _SPACY_ON_GPU
+
+
+@lru_cache(maxsize=2)
+def _get_nlp(lang: str):
+    """
+    按语言懒加载 spaCy 模型（首次使用时加载，之后复用）。
+    只做字符级分块或只处理单一语言时，不再为另一个模型付出加载时间和内存。
+    模型未安装时返回 None，调用方回退到 NLTK/正则。
+    """
+    if not HAS_SPACY:
+        return None
+    for model_name in _spacy_model_names(lang):
+        try:
+            nlp = spacy.load(model_name)
+        except OSError:
+            print(f"⚠️ spaCy模型未安装: {model_name}")
+            continue
+        print(f"✅ spaCy模型已加载: {model_name}")
+        return nlp
+    return None
+
+
+def _spacy_model_names(lang: str) -> List[str]:
+    """按优先级排列的候选模型名（GPU 已启用时 *_trf 在前）"""
+    model_names = [SPACY_MODELS.get(lang, SPACY_MODELS['en'])]
+    if _SPACY_ON_GPU:
+        model_names.insert(0, SPACY_TRF_MODELS.get(lang, SPACY_TRF_MODELS['en']))
+    return model_names
+
+
+@lru_cache(maxsize=2)
+def _sentence_splitter_id(on_gpu: bool) -> tuple:
+    models = []
+    if HAS_SPACY:
+        for lang in SPACY_MODELS:
+            # 只检查包是否安装（不加载模型），取 _get_nlp 会选中的第一个
+            model = next(
+                (
+                    f"{name}=={spacy.util.get_package_version(name)}"
+                    for name in _spacy_model_names(lang)
+                    if spacy.util.is_package(name)
+                ),
+                None,
+            )
+            models.append((lang, model))
+    return (('spacy', HAS_SPACY), ('spacy_gpu', on_gpu),
+            ('spacy_models', tuple(models)), ('nltk', HAS_NLTK))
+
+
+def sentence_splitter_id() -> Dict:
+    """
+    当前环境实际会使用的分句器（spaCy 模型及版本、NLTK punkt 是否可用）。
+    分块结果依赖它：之后安装模型 / punkt 数据时，分块缓存键随之变化。
+    """
+    return dict(_sentence_splitter_id(_SPACY_ON_GPU))
+
+
+@lru_cache(maxsize=4)
+def _punkt(lang: str = 'english'):
+    """
+    复用 Punkt 分句器实例。
+    部分 NLTK 版本的 sent_tokenize 每次调用都会重新构造 PunktTokenizer。
+    """
+    try:
+        from nltk.tokenize.punkt import PunktTokenizer
+    except ImportError:
+        # NLTK < 3.8.2 没有 PunktTokenizer，直接加载 pickle 模型
+        return nltk.data.load(f'tokenizers/punkt/{lang}.pickle')
+    return PunktTokenizer(lang)
+
+
+@lru_cache(maxsize=256)
+def _sent_tokenize_cached(text: str) -> tuple:
+    """分句结果缓存（返回 tuple 以保证可哈希、不可变）"""
+    return tuple(_punkt().tokenize(text))
+
+try:
+    import lxml  # noqa: F401  BeautifulSoup 的 C 解析后端
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
 try:
     from pypdf import PdfReader
     HAS_PYPDF = True
@@ -58,13 +170,68 @@ except ImportError:
     print("⚠️ pypdf未安装，PDF将无法可靠抽取正文")
 
 
+# 预编译正则：clean_text 对每个文档、每一行都会用到
+# PDF 噪音行（页码 / "Page x of y" / 版权声明）合并为一个交替模式，一次匹配判定
+_PDF_SKIP_RE = re.compile(
+    r'^(?:[-\s]*\d+[-\s]*|Page\s+\d+\s+of\s+\d+|Copyright.*|©.*)$',
+    re.IGNORECASE,
+)
+_WHITESPACE_RE = re.compile(r'\s+')
+_CRLF_RE = re.compile(r'\r\n?')
+_INLINE_SPACE_RE = re.compile(r'[ \t]+')
+_EXCESS_NEWLINES_RE = re.compile(r'\n{3,}')
+_SENTENCE_END_RE = re.compile(r'[.!?。！？]\s+')
+_NUMERIC_LINE_RE = re.compile(r'^[\d\s\-./]+$')
+
+# spaCy 组件按用途裁剪：分句只需要 parser（doc.sents），
+# 元数据只需要 tagger/attribute_ruler（token.pos_）和 ner（doc.ents）
+_SENT_DISABLED_PIPES = ("tagger", "attribute_ruler", "lemmatizer", "ner")
+_META_DISABLED_PIPES = ("parser", "lemmatizer")
+
+# spaCy 实体标签 -> 元数据中的实体类别
+_ENTITY_KEYS = ('persons', 'organizations', 'locations', 'products', 'other')
+_ENTITY_LABEL_KEYS = {
+    'PERSON': 'persons', 'PER': 'persons',
+    'ORG': 'organizations', 'ORGANIZATION': 'organizations',
+    'GPE': 'locations', 'LOC': 'locations', 'LOCATION': 'locations',
+    'PRODUCT': 'products', 'WORK_OF_ART': 'products',
+}
+
+
+def _count_cjk(text: str, limit: int = 1000) -> int:
+    """统计前 limit 个字符中的 CJK 统一表意文字数量（向量化比较，不构造匹配列表）"""
+    codepoints = np.frombuffer(text[:limit].encode('utf-32-le'), dtype=np.uint32)
+    return int(np.count_nonzero((codepoints >= 0x4E00) & (codepoints <= 0x9FFF)))
+
+
+def _spacy_lang(text: str, language: str = 'auto') -> str:
+    """选择 spaCy 模型语言：auto 时按前 1000 字符中的汉字数判断"""
+    if language == 'auto':
+        return "zh" if _count_cjk(text, 1000) > 50 else "en"
+    return "zh" if language == 'zh' else "en"
+
+
+def _disabled_pipes(nlp, names):
+    """在 with 块内临时禁用 nlp 中存在的指定组件"""
+    return nlp.select_pipes(disable=[name for name in names if name in nlp.pipe_names])
+
+
 class EnhancedDocumentCleaner:
     """增强版文档清洗类 - 支持NLTK和spaCy"""
     
+    # 清洗 / 分块输出发生变化时递增，使分块缓存失效
+    VERSION = 2
+    
     def __init__(self, config: dict = None):
         self.config = config or {}
         self.remove_patterns = self.config.get('remove_patterns', [])
+        self._remove_patterns = [
+            re.compile(pattern, re.MULTILINE | re.IGNORECASE)
+            for pattern in self.remove_patterns
+        ]
         self.min_line_length = self.config.get('min_line_length', 10)
+        # 编码检测只分析文件开头的样本，避免对大文件做全量统计
+        self.encoding_sample_size = self.config.get('encoding_sample_size', 32768)
         
         # 功能标志
         self.use_chardet = HAS_CHARDET
@@ -94,33 +261,45 @@ class EnhancedDocumentCleaner:
                 with open(path, 'r', encoding='utf-8', errors='ignore') as f:
                     return f.read()
 
-        if self.use_chardet:
-            with open(path, 'rb') as f:
-                raw_data = f.read()
-            
-            result = chardet.detect(raw_data)
-            encoding = result['encoding']
-            confidence = result['confidence'] or 0.0
-            
-            if confidence < 0.7:
-                print(f"⚠️ 编码检测置信度较低: {confidence:.2f}, 使用UTF-8")
-                encoding = 'utf-8'
-            
-            try:
-                return raw_data.decode(encoding)
-            except Exception:
-                return raw_data.decode('utf-8', errors='ignore')
-        else:
-            try:
-                with open(path, 'r', encoding='utf-8') as f:
-                    return f.read()
-            except Exception:
-                with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-                    return f.read()
+        with open(path, 'rb') as f:
+            raw_data = f.read()
+
+        # 快速路径：绝大多数文档是 UTF-8（含 BOM），无需任何检测
+        try:
+            return raw_data.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            pass
+
+        if not self.use_chardet:
+            return raw_data.decode('utf-8', errors='ignore')
+
+        encoding, confidence = self._detect_encoding(raw_data)
+        if not encoding or confidence < 0.7:
+            print(f"⚠️ 编码检测置信度较低: {confidence:.2f}, 使用UTF-8")
+            encoding = 'utf-8'
+
+        try:
+            return raw_data.decode(encoding)
+        except Exception:
+            return raw_data.decode('utf-8', errors='ignore')
+
+    def _detect_encoding(self, raw_data: bytes):
+        """只对开头 encoding_sample_size 字节做增量检测，检测器确定后立即停止"""
+        detector = chardet.UniversalDetector()
+        sample_end = min(len(raw_data), self.encoding_sample_size)
+        step = 4096
+        for start in range(0, sample_end, step):
+            detector.feed(raw_data[start:min(start + step, sample_end)])
+            if detector.done:
+                break
+        detector.close()
+
+        result = detector.result or {}
+        return result.get('encoding'), result.get('confidence') or 0.0
 
     @staticmethod
     def _normalize_line(line: str) -> str:
-        line = re.sub(r'\s+', ' ', line).strip()
+        line = _WHITESPACE_RE.sub(' ', line).strip()
         return line
 
     def _extract_pdf_text(self, file_path: Path) -> str:
@@ -190,16 +369,14 @@ class EnhancedDocumentCleaner:
     def _clean_html(self, html_content: str) -> str:
         """清洗HTML内容"""
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
+            soup = BeautifulSoup(html_content, HTML_PARSER)
             
-            for script in soup(['script', 'style', 'meta', 'link', 'noscript']):
-                script.decompose()
+            for tag in soup.select('script, style, meta, link, noscript'):
+                tag.decompose()
             
+            # 按行 strip 并去掉空行（单个文本节点内部的空行也要去掉）
             text = soup.get_text(separator='\n')
-            lines = [line.strip() for line in text.split('\n')]
-            lines = [line for line in lines if line]
-            
-            return '\n'.join(lines)
+            return '\n'.join(line for line in map(str.strip, text.split('\n')) if line)
         except Exception as e:
             print(f"HTML清洗失败: {e}")
             return html_content
@@ -215,13 +392,7 @@ class EnhancedDocumentCleaner:
             if not line:
                 continue
             
-            if re.match(r'^[-\s]*\d+[-\s]*$', line):
-                continue
-            if re.match(r'^Page\s+\d+\s+of\s+\d+$', line, re.IGNORECASE):
-                continue
-            if re.match(r'^Copyright.*$', line, re.IGNORECASE):
-                continue
-            if re.match(r'^©.*$', line):
+            if _PDF_SKIP_RE.match(line):
                 continue
             if 'All rights reserved' in line:
                 continue
@@ -235,18 +406,19 @@ class EnhancedDocumentCleaner:
     
     def _general_clean(self, text: str) -> str:
         """通用文本清洗"""
-        text = text.replace('\r\n', '\n').replace('\r', '\n')
-        text = re.sub(r'[ \t]+', ' ', text)
-        text = re.sub(r'\n{3,}', '\n\n', text)
+        text = _CRLF_RE.sub('\n', text)
+        text = _INLINE_SPACE_RE.sub(' ', text)
+        text = _EXCESS_NEWLINES_RE.sub('\n\n', text)
         
-        for pattern in self.remove_patterns:
-            text = re.sub(pattern, '', text, flags=re.MULTILINE | re.IGNORECASE)
+        for pattern in self._remove_patterns:
+            text = pattern.sub('', text)
         
-        lines = [line.strip() for line in text.split('\n')]
+        # 逐行 strip 与去重合并为一次遍历
         # 仅去掉连续重复行，避免误删语义上重复但分散出现的内容
         deduped_lines = []
         prev_line = None
-        for line in lines:
+        for line in text.split('\n'):
+            line = line.strip()
             if line and line == prev_line:
                 continue
             deduped_lines.append(line)
@@ -282,13 +454,14 @@ class EnhancedDocumentCleaner:
         
         # 如果文件名太短或不合适，尝试从内容提取
         if len(title) < 3 or title.isdigit():
-            lines = text.split('\n')[:15]  # 增加到前15行
+            # 只切出前15行（maxsplit），不为整篇文档构造行列表
+            lines = text.split('\n', 15)[:15]
             for line in lines:
                 line = line.strip()
                 # 寻找合适的标题行
                 if 10 < len(line) < 200:
                     # 排除纯数字、日期、页码等
-                    if not re.match(r'^[\d\s\-./]+$', line):
+                    if not _NUMERIC_LINE_RE.match(line):
                         title = line
                         break
             
@@ -305,7 +478,7 @@ class EnhancedDocumentCleaner:
         if HAS_NLTK:
             try:
                 # 只处理前3000字符以提高性能
-                sentences = sent_tokenize(clean_text[:3000])
+                sentences = _sent_tokenize_cached(clean_text[:3000])
                 
                 # 选择前3-5个句子，总长度不超过500字符
                 summary_sentences = []
@@ -341,55 +514,39 @@ class EnhancedDocumentCleaner:
             try:
                 # 自动检测语言
                 if language == 'auto':
-                    chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', text[:1000]))
+                    chinese_chars = _count_cjk(text, 1000)
                     is_chinese = chinese_chars > 50
-                    nlp = nlp_zh if is_chinese else nlp_en
+                    nlp = _get_nlp("zh" if is_chinese else "en")
                 else:
-                    nlp = nlp_zh if language == 'zh' else nlp_en
+                    nlp = _get_nlp("zh" if language == 'zh' else "en")
                 
                 if nlp is None:
                     return metadata
                 
                 # 只处理前5000字符（性能考虑）
-                doc = nlp(text[:5000])
+                with _disabled_pipes(nlp, _META_DISABLED_PIPES):
+                    doc = nlp(text[:5000])
                 
-                # 提取命名实体
-                entities = {
-                    'persons': [],
-                    'organizations': [],
-                    'locations': [],
-                    'products': [],
-                    'other': []
-                }
+                # 提取命名实体：按出现顺序去重，每类最多 5 个，全部满额即停止
+                entities = {key: {} for key in _ENTITY_KEYS}
+                full = set()
                 
                 for ent in doc.ents:
-                    if ent.label_ in ['PERSON', 'PER']:
-                        entities['persons'].append(ent.text)
-                    elif ent.label_ in ['ORG', 'ORGANIZATION']:
-                        entities['organizations'].append(ent.text)
-                    elif ent.label_ in ['GPE', 'LOC', 'LOCATION']:
-                        entities['locations'].append(ent.text)
-                    elif ent.label_ in ['PRODUCT', 'WORK_OF_ART']:
-                        entities['products'].append(ent.text)
-                    else:
-                        entities['other'].append(ent.text)
-                
-                # 去重并限制数量
-                for key in entities:
-                    entities[key] = list(set(entities[key]))[:5]
+                    key = _ENTITY_LABEL_KEYS.get(ent.label_, 'other')
+                    if key in full:
+                        continue
+                    bucket = entities[key]
+                    bucket[ent.text] = None
+                    if len(bucket) >= 5:
+                        full.add(key)
+                        if len(full) == len(entities):
+                            break
                 
+                entities = {key: list(bucket) for key, bucket in entities.items()}
                 metadata['entities'] = entities
                 
-                # 提取关键词（名词和专有名词）
-                keywords = []
-                for token in doc:
-                    if token.pos_ in ['NOUN', 'PROPN'] and len(token.text) > 2:
-                        keywords.append(token.text)
-                
-                # 统计频率，取top 10
-                from collections import Counter
-                keyword_freq = Counter(keywords)
-                metadata['keywords'] = [kw for kw, _ in keyword_freq.most_common(10)]
+                # 提取关键词（名词和专有名词），取频率 top 10
+                metadata['keywords'] = _top_keywords(doc, 10)
                 
             except Exception as e:
                 print(f"⚠️ spaCy元数据提取失败: {e}")
@@ -416,6 +573,25 @@ class EnhancedDocumentCleaner:
         return chunk_meta
 
 
+def _top_keywords(doc, limit: int = 10) -> List[str]:
+    """
+    统计长度 > 2 的名词/专有名词词频，返回前 limit 个。
+    在 doc.to_array 导出的整数属性矩阵上做筛选和计数，避免逐 token 的 Python 分支；
+    同频词按首次出现顺序排列（与 Counter.most_common 一致）。
+    """
+    if len(doc) == 0:
+        return []
+    attrs = doc.to_array([POS, ORTH, LENGTH])
+    mask = np.isin(attrs[:, 0], (NOUN, PROPN)) & (attrs[:, 2] > 2)
+    if not mask.any():
+        return []
+    orths, first_seen, counts = np.unique(
+        attrs[mask, 1], return_index=True, return_counts=True
+    )
+    order = np.lexsort((first_seen, -counts))[:limit]
+    return [doc.vocab.strings[int(orths[i])] for i in order]
+
+
 # 保留原有的分块函数（不变）
 def smart_chunk_text_enhanced(
     text: str,
@@ -426,8 +602,13 @@ def smart_chunk_text_enhanced(
     language: str = 'auto',
     use_nltk: bool = True,
     use_spacy: bool = True,
+    spacy_n_process: int = 1,
 ) -> List[str]:
-    """增强版智能文本分块"""
+    """增强版智能文本分块
+
+    spacy_n_process > 1 时，超长文本的多个 spaCy 批次会用多进程并行分句
+    （进程启动有固定开销，只有文本超过单批大小时才会启用）。
+    """
     if not text or len(text.strip()) < min_chunk_size:
         return []
     
@@ -436,15 +617,13 @@ def smart_chunk_text_enhanced(
     
     if use_spacy and HAS_SPACY:
         try:
-            if language == 'auto':
-                chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', text[:1000]))
-                is_chinese = chinese_chars > 50
-                nlp = nlp_zh if is_chinese else nlp_en
-            else:
-                nlp = nlp_zh if language == 'zh' else nlp_en
+            nlp = _get_nlp(_spacy_lang(text, language))
             
             if nlp is not None:
-                return _chunk_by_spacy(text, chunk_size, overlap, min_chunk_size, nlp)
+                return _chunk_by_spacy(
+                    text, chunk_size, overlap, min_chunk_size, nlp,
+                    n_process=spacy_n_process,
+                )
         except Exception as e:
             print(f"⚠️ spaCy分块失败，回退到NLTK: {e}")
     
@@ -457,15 +636,27 @@ def smart_chunk_text_enhanced(
     return _chunk_by_sentences_regex(text, chunk_size, overlap, min_chunk_size)
 
 
-def _chunk_by_spacy(text: str, chunk_size: int, overlap: int, min_size: int, nlp) -> List[str]:
+def _chunk_by_spacy(
+    text: str,
+    chunk_size: int,
+    overlap: int,
+    min_size: int,
+    nlp,
+    n_process: int = 1,
+) -> List[str]:
     """使用spaCy分块"""
     max_chars_per_batch = 100000
     all_sentences = []
+    batches = [
+        text[i:i + max_chars_per_batch]
+        for i in range(0, len(text), max_chars_per_batch)
+    ]
+    # 只有多个批次时多进程才有意义
+    n_process = max(1, min(n_process, len(batches)))
     
-    for i in range(0, len(text), max_chars_per_batch):
-        batch = text[i:i + max_chars_per_batch]
-        doc = nlp(batch)
-        all_sentences.extend([sent.text for sent in doc.sents])
+    with _disabled_pipes(nlp, _SENT_DISABLED_PIPES):
+        for doc in nlp.pipe(batches, batch_size=8, n_process=n_process):
+            all_sentences.extend(sent.text for sent in doc.sents)
     
     return _build_chunks_from_sentences(all_sentences, chunk_size, overlap, min_size)
 
@@ -473,7 +664,7 @@ def _chunk_by_spacy(text: str, chunk_size: int, overlap: int, min_size: int, nlp
 def _chunk_by_nltk(text: str, chunk_size: int, overlap: int, min_size: int) -> List[str]:
     """使用NLTK分块"""
     try:
-        sentences = sent_tokenize(text)
+        sentences = _punkt().tokenize(text)
         return _build_chunks_from_sentences(sentences, chunk_size, overlap, min_size)
     except Exception as e:
         print(f"NLTK分块错误: {e}")
@@ -482,16 +673,20 @@ def _chunk_by_nltk(text: str, chunk_size: int, overlap: int, min_size: int) -> L
 
 def _chunk_by_sentences_regex(text: str, chunk_size: int, overlap: int, min_size: int) -> List[str]:
     """使用正则分块"""
-    sentences = re.split(r'([.!?。！？]\s+)', text)
-    
-    full_sentences = []
-    for i in range(0, len(sentences), 2):
-        if i + 1 < len(sentences):
-            full_sentences.append(sentences[i] + sentences[i + 1])
-        else:
-            full_sentences.append(sentences[i])
-    
-    return _build_chunks_from_sentences(full_sentences, chunk_size, overlap, min_size)
+    return _build_chunks_from_sentences(_iter_regex_sentences(text), chunk_size, overlap, min_size)
+
+
+def _iter_regex_sentences(text: str) -> Iterator[str]:
+    """
+    按句末标点 + 空白逐句产出（句子包含其结尾标点和空白）。
+    与 re.split 捕获分隔符后两两拼接的结果相同，但不构造中间列表。
+    """
+    start = 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        end = match.end()
+        yield text[start:end]
+        start = end
+    yield text[start:]
 
 
 def _split_overlong_sentence(sentence: str, chunk_size: int) -> List[str]:
@@ -540,73 +735,103 @@ def _split_overlong_sentence(sentence: str, chunk_size: int) -> List[str]:
     return segments
 
 
-def _build_chunks_from_sentences(sentences: List[str], chunk_size: int, overlap: int, min_size: int) -> List[str]:
-    """从句子列表构建分块"""
+def _build_chunks_from_sentences(sentences: Iterable[str], chunk_size: int, overlap: int, min_size: int) -> List[str]:
+    """
+    从句子列表构建分块
+
+    在句子长度前缀和上用二分查找定位每个分块的结束句，每个分块只 join 一次。
+    分块规则：贪心累加句子直到超过 chunk_size；下一块以当前块末尾约 overlap
+    字符的整句开头（句子级 overlap），并且总是包含触发切分的那一句。
+    """
+    # _split_overlong_sentence 返回的片段均已 strip 且非空
+    pieces = [
+        piece
+        for raw_sentence in sentences
+        for piece in _split_overlong_sentence(raw_sentence, chunk_size)
+    ]
+    if not pieces:
+        return []
+
+    lengths = [len(piece) for piece in pieces]
+    # prefix[i] = 前 i 个句子的总长度（不含连接空格，与原累计口径一致）
+    prefix = [0, *accumulate(lengths)]
+    total = len(pieces)
+
     chunks = []
-    current_chunk = []
-    current_size = 0
-    
-    for raw_sentence in sentences:
-        for sentence in _split_overlong_sentence(raw_sentence, chunk_size):
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-            
-            sentence_len = len(sentence)
-            
-            if current_size + sentence_len > chunk_size and current_chunk:
-                chunk_text = ' '.join(current_chunk)
-                if len(chunk_text) >= min_size:
-                    chunks.append(chunk_text)
-                
-                if overlap > 0:
-                    # 句子级 overlap：回溯当前块末尾句子，避免字符截断造成语义破碎
-                    overlap_sentences = []
-                    overlap_size = 0
-                    for prev_sentence in reversed(current_chunk):
-                        if overlap_size + len(prev_sentence) > overlap and overlap_sentences:
-                            break
-                        overlap_sentences.append(prev_sentence)
-                        overlap_size += len(prev_sentence)
-                        if overlap_size >= overlap:
-                            break
-                    overlap_sentences.reverse()
+    start = 0
+    min_end = 1  # 当前块至少包含到 min_end（触发切分的句子必须保留）
 
-                    current_chunk = overlap_sentences + [sentence]
-                    current_size = sum(len(s) for s in current_chunk)
-                else:
-                    current_chunk = [sentence]
-                    current_size = sentence_len
-            else:
-                current_chunk.append(sentence)
-                current_size += sentence_len
-    
-    if current_chunk:
-        chunk_text = ' '.join(current_chunk)
+    while True:
+        # 从 start 开始、累计长度不超过 chunk_size 的最远结束位置
+        end = bisect_right(prefix, prefix[start] + chunk_size) - 1
+        end = min(max(end, min_end), total)
+
+        chunk_text = ' '.join(pieces[start:end])
         if len(chunk_text) >= min_size:
             chunks.append(chunk_text)
-    
+
+        if end >= total:
+            break
+
+        next_start = end
+        if overlap > 0:
+            # 句子级 overlap：回溯当前块末尾句子，避免字符截断造成语义破碎
+            overlap_size = 0
+            while next_start > start:
+                sentence_len = lengths[next_start - 1]
+                if overlap_size + sentence_len > overlap and next_start < end:
+                    break
+                next_start -= 1
+                overlap_size += sentence_len
+                if overlap_size >= overlap:
+                    break
+
+        start = next_start
+        min_end = end + 1
+
     return chunks
 
 
-def _chunk_by_chars(text: str, chunk_size: int, overlap: int, min_size: int) -> List[str]:
-    """简单的字符级分块"""
-    chunks = []
-    start = 0
+def _iter_char_chunk_spans(
+    text: str,
+    chunk_size: int,
+    overlap: int,
+    min_size: int,
+) -> Iterator[Tuple[int, int]]:
+    """
+    字符级分块的下标版本：产出去除首尾空白后的 (start, end)，不构造任何子串。
+    调用方可以按需切片，或只用下标做定位。
+    """
     text_len = len(text)
-    
+    start = 0
+
     while start < text_len:
         end = min(start + chunk_size, text_len)
-        chunk = text[start:end].strip()
-        
-        if len(chunk) >= min_size:
-            chunks.append(chunk)
-        
+
+        # 等价于 text[start:end].strip()，但只移动下标
+        left, right = start, end
+        while left < right and text[left].isspace():
+            left += 1
+        while right > left and text[right - 1].isspace():
+            right -= 1
+
+        if right - left >= min_size:
+            yield left, right
+
+        # 已到文本末尾；否则 start = end - overlap 会反复落在同一窗口
+        if end >= text_len:
+            break
         start = end - overlap
         if start <= 0:
             break
-    
-    return chunks
+
+
+def _chunk_by_chars(text: str, chunk_size: int, overlap: int, min_size: int) -> List[str]:
+    """简单的字符级分块"""
+    return [
+        text[left:right]
+        for left, right in _iter_char_chunk_spans(text, chunk_size, overlap, min_size)
+    ]
 
 
 if __name__ == "__main__":
@@ -19,7 +19,7 @@ PROJECT_ROOT = Path(__file__).parent.parent.resolve()
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
-from query_v2 import search
+from query_v2 import prefetch_query_embeddings, search
 
 
 @dataclass
@@ -61,6 +61,9 @@ def main():
     if not items:
         raise ValueError(f"queries file is empty: {queries_path}")
 
+    # 一次性批量生成未缓存的 query embedding，逐条检索时直接命中缓存
+    prefetch_query_embeddings([query for query, _ in items])
+
     eval_rows: List[QueryEval] = []
     hit_count = 0
     expected_count = 0
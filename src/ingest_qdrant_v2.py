@@ -9,17 +9,27 @@ import argparse
 import sys
 import hashlib
 import re
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict
+from dataclasses import asdict
+from functools import partial
+from typing import Callable, Iterable, List, Dict, Optional
 from qdrant_client import QdrantClient
 from qdrant_client.models import (
     Distance,
     VectorParams,
-    PointStruct,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    Batch,
     Filter,
     FieldCondition,
     MatchValue,
 )
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
 
 # 获取项目根目录（ingest_qdrant_v2.py 的父级的父级）
 project_root = Path(__file__).parent.parent
@@ -31,12 +41,18 @@ try:
     from utils.helpers import (
         setup_logger,
         PerformanceMetrics,
+        ChunkCache,
         DiskCache,
+        FILE_HASH_ALGORITHM,
+        get_file_hash,
+        retry_on_failure,
         show_progress,
         file_batch_iterator
     )
     from document_cleaner_enhanced import (
         EnhancedDocumentCleaner,
+        enable_spacy_gpu,
+        sentence_splitter_id,
         smart_chunk_text_enhanced
     )
     from azure_embedding import AzureOpenAIEmbedding
@@ -57,16 +73,11 @@ class DocumentIngester:
             config_path: 配置文件路径
         """
         # 加载配置
+        self.config_path = config_path
         self.settings = get_settings(config_path)
         
         # 设置日志
-        self.logger = setup_logger(
-            name="DocumentIngester",
-            level=self.settings.logging.level,
-            log_file=self.settings.logging.file,
-            console_output=self.settings.logging.console_output,
-            colored_output=self.settings.logging.colored_output
-        )
+        self.logger = self._build_logger()
         
         self.logger.info("="*60)
         self.logger.info("🚀 RAG 文档摄取系统启动")
@@ -76,19 +87,36 @@ class DocumentIngester:
         self.logger.info("📦 初始化组件...")
         
         # 1. Qdrant 客户端
+        qdrant_cfg = self.settings.qdrant
+        qdrant_kwargs = {}
+        if qdrant_cfg.prefer_grpc and qdrant_cfg.grpc_compression:
+            import grpc
+            qdrant_kwargs['grpc_compression'] = grpc.Compression.Gzip
         self.qdrant = QdrantClient(
-            host=self.settings.qdrant.host,
-            port=self.settings.qdrant.port
+            host=qdrant_cfg.host,
+            port=qdrant_cfg.port,
+            grpc_port=qdrant_cfg.grpc_port,
+            prefer_grpc=qdrant_cfg.prefer_grpc,
+            **qdrant_kwargs
         )
-        self.logger.info(f"✅ Qdrant: {self.settings.qdrant.host}:{self.settings.qdrant.port}")
+        if qdrant_cfg.prefer_grpc:
+            self.logger.info(f"✅ Qdrant: {qdrant_cfg.host}:{qdrant_cfg.grpc_port} (gRPC)")
+        else:
+            self.logger.info(f"✅ Qdrant: {qdrant_cfg.host}:{qdrant_cfg.port}")
         
         # 2. Azure OpenAI Embedding
         try:
             self.embedder = AzureOpenAIEmbedding(
                 max_retries=self.settings.embedding.max_retries,
-                timeout=self.settings.embedding.timeout
+                timeout=self.settings.embedding.timeout,
+                max_concurrency=self.settings.embedding.max_concurrency,
+                batch_size=self.settings.embedding.batch_size,
+                adaptive_batch_size=self.settings.embedding.adaptive_batch_size,
+                near_duplicate_threshold=self.settings.embedding.near_duplicate_threshold,
+            )
+            self.logger.info(
+                f"✅ Azure OpenAI Embedding (并发 {self.settings.embedding.max_concurrency})"
             )
-            self.logger.info(f"✅ Azure OpenAI Embedding")
             
             # 测试连接
             #if not self.embedder.test_connection():
@@ -99,18 +127,18 @@ class DocumentIngester:
             raise
         
         # 3. 文档清洗器
-        self.cleaner = EnhancedDocumentCleaner({
-            'remove_patterns': self.settings.cleaning.custom_patterns,
-            'min_line_length': self.settings.cleaning.min_line_length
-        })
+        self.cleaner = self._build_cleaner()
+        self._chunk = self._build_chunker()
         self.logger.info(f"✅ 文档清洗器 (增强功能已启用)")
         
         # 4. 缓存系统
+        self.chunk_cache = self._build_chunk_cache()
         if self.settings.processing.enable_caching:
-            cache_dir = Path(self.settings.processing.cache_dir)
-            if not cache_dir.is_absolute():
-                cache_dir = project_root / cache_dir
-            self.cache = DiskCache(str(cache_dir))
+            cache_dir = self._cache_dir()
+            self.cache = DiskCache(
+                str(cache_dir),
+                vector_dtype=self.settings.processing.cache_vector_dtype,
+            )
             self.cache_namespace = (
                 f"embedding:{self.settings.embedding.provider}:"
                 f"{self.settings.embedding.model}:{self.embedder.deployment_name}:{self.embedder.api_version}"
@@ -128,6 +156,68 @@ class DocumentIngester:
         
         self.logger.info("✨ 初始化完成\n")
         
+    @classmethod
+    def for_processing(cls, config_path: str = "config/config_azure.yaml") -> "DocumentIngester":
+        """
+        只初始化文档处理（加载/清洗/元数据/分块）所需的组件，
+        不连接 Qdrant / Azure OpenAI；供多进程 worker 调用 process_document。
+        """
+        self = cls.__new__(cls)
+        self.config_path = config_path
+        self.settings = get_settings(config_path)
+        self.logger = self._build_logger()
+        self.cleaner = self._build_cleaner()
+        self._chunk = self._build_chunker()
+        self.chunk_cache = self._build_chunk_cache()
+        self.metrics = PerformanceMetrics()
+        return self
+    
+    def _cache_dir(self) -> Path:
+        cache_dir = Path(self.settings.processing.cache_dir)
+        if not cache_dir.is_absolute():
+            cache_dir = project_root / cache_dir
+        return cache_dir
+    
+    def _build_chunk_cache(self) -> Optional[ChunkCache]:
+        if not self.settings.processing.enable_caching:
+            return None
+        return ChunkCache(str(self._cache_dir()))
+    
+    def _build_logger(self):
+        return setup_logger(
+            name="DocumentIngester",
+            level=self.settings.logging.level,
+            log_file=self.settings.logging.file,
+            console_output=self.settings.logging.console_output,
+            colored_output=self.settings.logging.colored_output
+        )
+    
+    def _build_chunker(self) -> Callable[[str], List[str]]:
+        """分块参数在整个摄取过程中不变，绑定一次"""
+        chunking = self.settings.chunking
+        return partial(
+            smart_chunk_text_enhanced,
+            chunk_size=chunking.chunk_size,
+            overlap=chunking.overlap,
+            min_chunk_size=chunking.min_chunk_size,
+            respect_sentence=chunking.respect_sentence,
+            language=chunking.language,
+            use_nltk=chunking.use_nltk,
+            use_spacy=chunking.use_spacy,
+            spacy_n_process=chunking.spacy_n_process,
+        )
+    
+    def _build_cleaner(self) -> EnhancedDocumentCleaner:
+        cleaner = EnhancedDocumentCleaner({
+            'remove_patterns': self.settings.cleaning.custom_patterns,
+            'min_line_length': self.settings.cleaning.min_line_length,
+            'encoding_sample_size': self.settings.cleaning.encoding_sample_size,
+        })
+        if self.settings.chunking.use_spacy and self.settings.chunking.spacy_gpu:
+            if not enable_spacy_gpu():
+                self.logger.warning("⚠️ 未检测到可用 GPU，spaCy 使用 CPU")
+        return cleaner
+        
     def _ensure_collection(self):
         """确保 Qdrant 集合存在"""
         collection_name = self.settings.qdrant.collection_name
@@ -139,13 +229,24 @@ class DocumentIngester:
             
             if not exists:
                 self.logger.info(f"📦 创建集合: {collection_name}")
+
+                quantization_config = None
+                if self.settings.qdrant.scalar_quantization:
+                    quantization_config = ScalarQuantization(
+                        scalar=ScalarQuantizationConfig(
+                            type=ScalarType.INT8,
+                            always_ram=True,
+                        )
+                    )
+                    self.logger.info("   启用 INT8 标量量化")
                 
                 self.qdrant.create_collection(
                     collection_name=collection_name,
                     vectors_config=VectorParams(
                         size=self.settings.qdrant.vector_size,
                         distance=Distance.COSINE
-                    )
+                    ),
+                    quantization_config=quantization_config,
                 )
                 self.logger.info(f"✅ 集合创建成功")
             else:
@@ -173,29 +274,14 @@ class DocumentIngester:
         """
         with self.metrics.timer('document_processing'):
             try:
-                # 1. 加载文件
-                with self.metrics.timer('file_loading'):
-                    content = self.cleaner.load_file_with_encoding(str(file_path))
-                    
-                if not content or len(content) < 10:
-                    self.logger.warning(f"⚠️  文件内容为空或太短: {file_path.name}")
-                    return []
-                
-                # 2. 清洗文本
-                with self.metrics.timer('text_cleaning'):
-                    extension = file_path.suffix.lower().lstrip('.')
-                    cleaned = self.cleaner.clean_text(content, extension)
-
-                if not cleaned or len(cleaned.strip()) < 50:
-                    self.logger.warning(f"⚠️  清洗后内容过短，跳过: {file_path.name}")
+                # 1-3, 5. 加载 / 清洗 / 元数据 / 分块（未修改的文件直接取缓存）
+                prepared = self._prepare_document(file_path)
+                if prepared is None:
                     return []
-                    
-                # 3. 提取元数据
-                with self.metrics.timer('metadata_extraction'):
-                    metadata = self.cleaner.extract_metadata_enhanced(
-                        cleaned,
-                        str(file_path)
-                    )
+                metadata = prepared['metadata']
+                chunks = prepared['chunks']
+                removed_dup_chunks = prepared['removed_dup_chunks']
+                extension = file_path.suffix.lower().lstrip('.')
                 
                 # 4. 分类策略（优先目录名，再回退自动分类）
                 effective_category = category
@@ -211,35 +297,9 @@ class DocumentIngester:
                         pass
 
                 if not effective_category:
-                    detected_category = self.settings.auto_categorize(cleaned)
-                    effective_category = detected_category.name
+                    effective_category = prepared['auto_category']
                     self.logger.info(f"   自动分类: {effective_category}")
                 
-                # 5. 分块
-                with self.metrics.timer('text_chunking'):
-                    chunks = smart_chunk_text_enhanced(
-                        cleaned,
-                        chunk_size=self.settings.chunking.chunk_size,
-                        overlap=self.settings.chunking.overlap,
-                        min_chunk_size=self.settings.chunking.min_chunk_size,
-                        respect_sentence=self.settings.chunking.respect_sentence,
-                        language=self.settings.chunking.language,
-                        use_nltk=self.settings.chunking.use_nltk,
-                        use_spacy=self.settings.chunking.use_spacy,
-                    )
-
-                # 文件内分块去重，降低噪音和向量冗余
-                unique_chunks = []
-                seen_chunk_hashes = set()
-                for chunk in chunks:
-                    chunk_hash = hashlib.md5(chunk.encode("utf-8")).hexdigest()
-                    if chunk_hash in seen_chunk_hashes:
-                        continue
-                    seen_chunk_hashes.add(chunk_hash)
-                    unique_chunks.append(chunk)
-                removed_dup_chunks = len(chunks) - len(unique_chunks)
-                chunks = unique_chunks
-                
                 if not chunks:
                     self.logger.warning(f"⚠️  无法分块: {file_path.name}")
                     return []
@@ -322,16 +382,23 @@ class DocumentIngester:
             cached_indices = []
             dedup_saved = 0
             
+            # 一次批量查询缓存
+            cached = {}
+            if self.cache:
+                cached = self.cache.get_many(
+                    [doc['text'] for doc in documents],
+                    namespace=self.cache_namespace
+                )
+            
             for i, doc in enumerate(documents):
                 text = doc['text']
                 
                 # 检查缓存
-                if self.cache:
-                    cached_emb = self.cache.get(text, namespace=self.cache_namespace)
-                    if cached_emb is not None:
-                        doc['vector'] = cached_emb
-                        cached_indices.append(i)
-                        continue
+                cached_emb = cached.get(text)
+                if cached_emb is not None:
+                    doc['vector'] = cached_emb
+                    cached_indices.append(i)
+                    continue
                 
                 if text in unique_text_to_indices:
                     unique_text_to_indices[text].append(i)
@@ -355,18 +422,18 @@ class DocumentIngester:
                 )
                 
                 try:
-                    embeddings = self.embedder.embed_batch(
-                        unique_texts,
-                        batch_size=self.settings.embedding.batch_size,
-                        show_progress=False
-                    )
+                    # 批大小由客户端决定（构造时传入 batch_size；开启 adaptive_batch_size 时自动调整）
+                    embeddings = self.embedder.embed_batch(unique_texts, show_progress=False)
                     
                     # 分配 embeddings 并缓存
                     for text, emb in zip(unique_texts, embeddings):
                         for idx in unique_text_to_indices[text]:
                             documents[idx]['vector'] = emb
-                        if self.cache:
-                            self.cache.set(text, emb, namespace=self.cache_namespace)
+                    if self.cache:
+                        self.cache.set_many(
+                            dict(zip(unique_texts, embeddings)),
+                            namespace=self.cache_namespace
+                        )
                     
                     self.metrics.increment('embeddings_generated', len(embeddings))
                     
@@ -419,6 +486,91 @@ class DocumentIngester:
 
         return True
                 
+    def _chunk_params(self, file_path: Path) -> Dict:
+        """影响 加载/清洗/元数据/分块 结果的全部参数（分块缓存键的一部分）"""
+        return {
+            'cleaner_version': EnhancedDocumentCleaner.VERSION,
+            # spaCy / NLTK 缺失时分块会回退到其它分句器，结果不同
+            'sentence_splitter': sentence_splitter_id(),
+            'file_name': file_path.name,  # 标题取自文件名
+            'chunking': asdict(self.settings.chunking),
+            'cleaning': asdict(self.settings.cleaning),
+            'categories': [
+                [c.name, c.keywords] for c in self.settings.categories
+            ],
+        }
+    
+    def _prepare_document(self, file_path: Path) -> Optional[Dict]:
+        """
+        加载、清洗、提取元数据、分块并去重；结果按文件内容哈希缓存
+        
+        Returns:
+            {'metadata', 'chunks', 'removed_dup_chunks', 'auto_category'}，
+            内容为空或过短时返回 None
+        """
+        file_hash = params_hash = None
+        if self.chunk_cache:
+            with self.metrics.timer('file_hashing'):
+                file_hash = get_file_hash(file_path)
+                params_hash = ChunkCache.params_hash(
+                    [FILE_HASH_ALGORITHM, self._chunk_params(file_path)]
+                )
+            prepared = self.chunk_cache.get(file_hash, params_hash)
+            if prepared is not None:
+                self.logger.info(f"   💾 分块缓存命中: {file_path.name}")
+                self.metrics.increment('chunk_cache_hits')
+                return prepared
+        
+        # 1. 加载文件
+        with self.metrics.timer('file_loading'):
+            content = self.cleaner.load_file_with_encoding(str(file_path))
+            
+        if not content or len(content) < 10:
+            self.logger.warning(f"⚠️  文件内容为空或太短: {file_path.name}")
+            return None
+        
+        # 2. 清洗文本
+        with self.metrics.timer('text_cleaning'):
+            extension = file_path.suffix.lower().lstrip('.')
+            cleaned = self.cleaner.clean_text(content, extension)
+
+        if not cleaned or len(cleaned.strip()) < 50:
+            self.logger.warning(f"⚠️  清洗后内容过短，跳过: {file_path.name}")
+            return None
+            
+        # 3. 提取元数据
+        with self.metrics.timer('metadata_extraction'):
+            metadata = self.cleaner.extract_metadata_enhanced(
+                cleaned,
+                str(file_path)
+            )
+        metadata.pop("source", None)
+        
+        # 5. 分块
+        with self.metrics.timer('text_chunking'):
+            chunks = self._chunk(cleaned)
+
+        # 文件内分块去重，降低噪音和向量冗余
+        unique_chunks = []
+        seen_chunk_hashes = set()
+        for chunk in chunks:
+            chunk_hash = hashlib.md5(chunk.encode("utf-8")).hexdigest()
+            if chunk_hash in seen_chunk_hashes:
+                continue
+            seen_chunk_hashes.add(chunk_hash)
+            unique_chunks.append(chunk)
+        
+        prepared = {
+            'metadata': metadata,
+            'chunks': unique_chunks,
+            'removed_dup_chunks': len(chunks) - len(unique_chunks),
+            # 自动分类只依赖清洗后文本，随结果一起缓存
+            'auto_category': self.settings.auto_categorize(cleaned).name,
+        }
+        if self.chunk_cache:
+            self.chunk_cache.set(file_hash, params_hash, prepared)
+        return prepared
+    
     def upsert_to_qdrant(self, documents: List[Dict]):
         """
         上传文档到 Qdrant（分批上传，避免 payload 过大）
@@ -426,8 +578,6 @@ class DocumentIngester:
         Args:
             documents: 文档列表
         """
-        import time
-        
         with self.metrics.timer('qdrant_upsert'):
             try:
                 if self.settings.processing.replace_existing_source:
@@ -453,23 +603,21 @@ class DocumentIngester:
                     if source_paths:
                         self.logger.info(f"   ♻️ 已清理旧数据源: {len(source_paths)} 个")
 
-                # 构建 points
-                all_points = []
+                # 构建并行的 ids / vectors / payloads 列表，按批打包为 Batch（不逐点构造 PointStruct）
+                ids, vectors, payloads = [], [], []
                 for doc in documents:
-                    if 'vector' not in doc:
+                    vector = doc.get('vector')
+                    if vector is None:
                         self.logger.warning(f"⚠️  缺少向量，跳过: {doc.get('id')}")
                         continue
-                    point = PointStruct(
-                        id=str(uuid.uuid5(uuid.NAMESPACE_DNS, doc['id'])),
-                        vector=doc['vector'],
-                        payload={
-                            'text': doc['text'],
-                            'metadata': doc['metadata']
-                        }
-                    )
-                    all_points.append(point)
+                    ids.append(_point_id(doc['id']))
+                    vectors.append(vector)
+                    payloads.append({
+                        'text': doc['text'],
+                        'metadata': doc['metadata']
+                    })
 
-                if not all_points:
+                if not ids:
                     self.logger.warning("⚠️  无可上传向量，跳过")
                     return
                 
@@ -477,29 +625,35 @@ class DocumentIngester:
                 # Qdrant 限制：32MB per request
                 # 每个向量约 3072 * 4 bytes = 12KB + text + metadata ≈ 40KB
                 # 安全批次：500 个点 ≈ 20MB
-                batch_size = 500
-                total_uploaded = 0
+                # gRPC 下向量以二进制传输，体积约为 JSON 的 1/4，可用更大批次
+                batch_size = 1000 if self.settings.qdrant.prefer_grpc else 500
+                total_batches = (len(ids) - 1) // batch_size + 1
+                batches = [
+                    Batch(
+                        ids=ids[i:i + batch_size],
+                        vectors=vectors[i:i + batch_size],
+                        payloads=payloads[i:i + batch_size]
+                    )
+                    for i in range(0, len(ids), batch_size)
+                ]
                 
-                self.logger.info(f"   准备上传 {len(all_points)} 个向量（分 {(len(all_points)-1)//batch_size + 1} 批）")
+                self.logger.info(f"   准备上传 {len(ids)} 个向量（分 {total_batches} 批）")
                 
-                for i in range(0, len(all_points), batch_size):
-                    batch = all_points[i:i + batch_size]
-                    batch_num = i // batch_size + 1
-                    total_batches = (len(all_points) - 1) // batch_size + 1
-                    
-                    self.logger.info(f"   📤 上传批次 {batch_num}/{total_batches} ({len(batch)} 个向量)")
-                    
-                    # 批量上传
-                    self.qdrant.upsert(
-                        collection_name=self.settings.qdrant.collection_name,
-                        points=batch
-                    )
-                    
-                    total_uploaded += len(batch)
-                    
-                    # 批次间短暂延迟（避免过载）
-                    if i + batch_size < len(all_points):
-                        time.sleep(1)
+                # 并发上传，由 Qdrant 的 429 / 错误重试控制节奏，不再固定等待
+                upsert_batch = retry_on_failure(
+                    max_retries=3,
+                    delay=1.0,
+                    exceptions=(UnexpectedResponse, ResponseHandlingException),
+                    logger=self.logger
+                )(self._upsert_batch)
+                workers = max(1, min(self.settings.qdrant.upsert_concurrency, total_batches))
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    total_uploaded = sum(executor.map(
+                        upsert_batch,
+                        batches,
+                        range(1, total_batches + 1),
+                        [total_batches] * total_batches
+                    ))
                 
                 self.logger.info(f"✅ 全部上传完成: {total_uploaded} 个向量")
                 self.metrics.increment('vectors_upserted', total_uploaded)
@@ -508,6 +662,24 @@ class DocumentIngester:
                 self.logger.error(f"❌ Qdrant 上传失败: {e}")
                 raise
                     
+    def _upsert_batch(self, batch: Batch, batch_num: int, total_batches: int) -> int:
+        """上传单个批次；遇到 429 时先按 Retry-After 等待再交给重试装饰器"""
+        self.logger.info(f"   📤 上传批次 {batch_num}/{total_batches} ({len(batch.ids)} 个向量)")
+        try:
+            self.qdrant.upsert(
+                collection_name=self.settings.qdrant.collection_name,
+                points=batch
+            )
+        except UnexpectedResponse as e:
+            if e.status_code == 429:
+                retry_after = (getattr(e, 'headers', None) or {}).get('retry-after')
+                try:
+                    time.sleep(min(float(retry_after), 60.0))
+                except (TypeError, ValueError):
+                    pass
+            raise
+        return len(batch.ids)
+        
     def ingest_directory(
         self,
         directory: Path,
@@ -527,53 +699,35 @@ class DocumentIngester:
         # 支持的文件类型
         file_extensions = ['.txt', '.md', '.pdf', '.html', '.htm']
         
-        # 收集文件
-        file_batches = list(file_batch_iterator(
+        # 边遍历目录边处理，不预先收集全部文件
+        file_batches = file_batch_iterator(
             directory,
             file_extensions,
             batch_size=self.settings.processing.batch_size,
             recursive=recursive
-        ))
+        )
         
-        total_files = sum(len(batch) for batch in file_batches)
-        self.logger.info(f"📊 找到 {total_files} 个文件")
+        # CPU 密集的文档处理（PDF 解析、清洗、分块）可用多进程并行
+        pool = None
+        processing = self.settings.processing
+        if processing.use_multiprocessing and processing.max_workers > 1:
+            pool = ProcessPoolExecutor(
+                max_workers=processing.max_workers,
+                initializer=_init_processing_worker,
+                initargs=(self.config_path,),
+            )
+            self.logger.info(f"⚙️  多进程文档处理: {processing.max_workers} 个进程")
+        
+        try:
+            total_files = self._ingest_batches(file_batches, category, directory, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
         
         if total_files == 0:
             self.logger.warning("⚠️  未找到可处理的文件")
             return
-        
-        # 处理文件
-        for batch in show_progress(
-            file_batches,
-            desc="处理文件批次",
-            total=len(file_batches)
-        ):
-            # 1. 处理文档
-            all_documents = []
-            for file_path in batch:
-                docs = self.process_document(file_path, category, ingest_root=directory)
-                all_documents.extend(docs)
-            
-            if not all_documents:
-                continue
-            
-            # 2. 生成 embeddings
-            try:
-                all_documents = self.embed_documents(all_documents)
-            except Exception as e:
-                self.logger.error(f"❌ Embedding 批次失败: {e}")
-                if not self.settings.processing.skip_errors:
-                    raise
-                continue
-            
-            # 3. 上传到 Qdrant
-            try:
-                self.upsert_to_qdrant(all_documents)
-            except Exception as e:
-                self.logger.error(f"❌ Qdrant 上传批次失败: {e}")
-                if not self.settings.processing.skip_errors:
-                    raise
-                continue
+        self.logger.info(f"📊 共处理 {total_files} 个文件")
         
         # 打印统计
         self.logger.info("\n" + "="*60)
@@ -584,6 +738,160 @@ class DocumentIngester:
         # 缓存统计
         if self.cache:
             self.cache.stats()
+    
+    def _process_batch(
+        self,
+        batch: List[Path],
+        category: str,
+        ingest_root: Path,
+        pool: "ProcessPoolExecutor" = None
+    ) -> List[Dict]:
+        """处理一批文件（有进程池时并行，结果按文件顺序合并）"""
+        all_documents = []
+        if pool is None:
+            for file_path in batch:
+                all_documents.extend(
+                    self.process_document(file_path, category, ingest_root=ingest_root)
+                )
+            return all_documents
+        
+        tasks = [(file_path, category, ingest_root) for file_path in batch]
+        for docs, timings, counters in pool.map(_process_document_worker, tasks):
+            all_documents.extend(docs)
+            self.metrics.merge(timings, counters)
+        return all_documents
+    
+    def _ingest_batches(
+        self,
+        file_batches: Iterable[List[Path]],
+        category: str,
+        directory: Path,
+        pool: "ProcessPoolExecutor" = None
+    ) -> int:
+        """
+        三段流水线：处理文档 -> embedding -> 上传，每段一个线程
+        
+        阶段之间用有界队列 (maxsize=2) 衔接：上传第 N 批时，
+        第 N+1 批在做 embedding，第 N+2 批在解析，CPU / 网络 / Qdrant 同时工作。
+        
+        Returns:
+            读取到的文件数
+        """
+        parse_q = queue.Queue(maxsize=2)
+        embed_q = queue.Queue(maxsize=2)
+        failed = threading.Event()
+        errors = []
+        total_files = 0
+        
+        def fail(stage: str, e: Exception):
+            self.logger.error(f"❌ {stage}批次失败: {e}")
+            if not self.settings.processing.skip_errors:
+                errors.append(e)
+                failed.set()
+        
+        def parse_stage():
+            nonlocal total_files
+            try:
+                for batch in show_progress(
+                    file_batches,
+                    desc="处理文件批次",
+                    unit="batch"
+                ):
+                    if failed.is_set():
+                        break
+                    total_files += len(batch)
+                    # 1. 处理文档
+                    try:
+                        all_documents = self._process_batch(batch, category, directory, pool)
+                    except Exception as e:
+                        fail("文档处理", e)
+                        continue
+                    if all_documents:
+                        parse_q.put(all_documents)
+            except BaseException as e:
+                # 文件遍历 / 进度条本身出错时也要让整个流水线失败，而不是静默结束
+                errors.append(e)
+                failed.set()
+            finally:
+                parse_q.put(_PIPELINE_END)
+        
+        def run_stage(in_q, out_q, fn, stage: str):
+            # 出错后仍继续取空上游队列直到结束标记，避免上游阻塞在 put 上
+            try:
+                while True:
+                    all_documents = in_q.get()
+                    if all_documents is _PIPELINE_END:
+                        break
+                    if failed.is_set():
+                        continue
+                    try:
+                        result = fn(all_documents)
+                    except Exception as e:
+                        fail(stage, e)
+                        continue
+                    if out_q is not None:
+                        out_q.put(result)
+            except BaseException as e:
+                errors.append(e)
+                failed.set()
+            finally:
+                if out_q is not None:
+                    out_q.put(_PIPELINE_END)
+        
+        threads = [
+            threading.Thread(target=parse_stage, name="ingest-parse"),
+            # 2. 生成 embeddings
+            threading.Thread(
+                target=run_stage,
+                args=(parse_q, embed_q, self.embed_documents, "Embedding "),
+                name="ingest-embed"
+            ),
+            # 3. 上传到 Qdrant
+            threading.Thread(
+                target=run_stage,
+                args=(embed_q, None, self.upsert_to_qdrant, "Qdrant 上传"),
+                name="ingest-upsert"
+            ),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            # 通知各阶段停止（当前批次完成后退出），否则解释器会等到全部摄取结束
+            failed.set()
+            raise
+        
+        if errors:
+            raise errors[0]
+        return total_files
+
+
+# 流水线结束标记
+_PIPELINE_END = object()
+
+
+def _point_id(doc_id: str) -> str:
+    """由文档块 id 派生 Qdrant 点 id（128 位 BLAKE2b 摘要作为 UUID，稳定且可复现）"""
+    return str(uuid.UUID(bytes=hashlib.blake2b(doc_id.encode('utf-8'), digest_size=16).digest()))
+
+
+# 多进程 worker：每个进程初始化一次只含处理组件的 DocumentIngester
+_worker_ingester = None
+
+
+def _init_processing_worker(config_path: str):
+    global _worker_ingester
+    _worker_ingester = DocumentIngester.for_processing(config_path)
+
+
+def _process_document_worker(task):
+    """在 worker 进程中处理单个文档，返回 (文档块, 计时, 计数) 供主进程合并统计"""
+    file_path, category, ingest_root = task
+    metrics = _worker_ingester.metrics = PerformanceMetrics()
+    docs = _worker_ingester.process_document(file_path, category, ingest_root=ingest_root)
+    return docs, dict(metrics.timings), dict(metrics.counters)
 
 
 def main():
@@ -10,7 +10,13 @@ import sys
 from pathlib import Path
 
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams
+from qdrant_client.models import (
+    Distance,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    VectorParams,
+)
 
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
@@ -34,14 +40,22 @@ def reset_collection(settings):
         client.delete_collection(collection_name=name)
         print(f"🗑️  已删除集合: {name}")
 
+    quantization_config = None
+    if settings.qdrant.scalar_quantization:
+        quantization_config = ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, always_ram=True)
+        )
+
     client.create_collection(
         collection_name=name,
         vectors_config=VectorParams(
             size=settings.qdrant.vector_size,
             distance=Distance.COSINE,
         ),
+        quantization_config=quantization_config,
     )
-    print(f"✅ 已重建集合: {name} (dim={settings.qdrant.vector_size})")
+    quant_label = ", int8" if quantization_config else ""
+    print(f"✅ 已重建集合: {name} (dim={settings.qdrant.vector_size}{quant_label})")
 
 
 def clear_cache_dir(path_str: str):
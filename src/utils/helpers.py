@@ -5,14 +5,35 @@
 """
 import time
 import logging
+import mmap
+import os
+import random
 import sys
 import hashlib
+import json
 import pickle
+import queue
+import sqlite3
+import struct
+import threading
+import weakref
 from pathlib import Path
 from functools import wraps
-from contextlib import contextmanager
+from itertools import islice
+from dataclasses import dataclass
 from typing import Callable, Iterator, List, TypeVar, Optional, Any, Dict
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+try:
+    import blake3
+    HAS_BLAKE3 = True
+except ImportError:
+    HAS_BLAKE3 = False
+
+# get_file_hash 使用的算法；持久化文件哈希时应一并记录
+FILE_HASH_ALGORITHM = "blake3" if HAS_BLAKE3 else "blake2b"
 
 # ============================================
 # 1. 重试机制
@@ -23,7 +44,8 @@ def retry_on_failure(
     delay: float = 1.0,
     backoff: float = 2.0,
     exceptions: tuple = (Exception,),
-    logger: logging.Logger = None
+    logger: logging.Logger = None,
+    jitter: bool = False
 ):
     """
     重试装饰器
@@ -34,6 +56,7 @@ def retry_on_failure(
         backoff: 延迟倍增因子
         exceptions: 需要重试的异常类型
         logger: 日志记录器
+        jitter: 是否使用 full jitter（实际等待在 [0, 当前延迟) 内均匀随机）
         
     Example:
         @retry_on_failure(max_retries=3, delay=1.0)
@@ -59,7 +82,7 @@ def retry_on_failure(
                         else:
                             print(msg)
                             
-                        time.sleep(current_delay)
+                        time.sleep(current_delay * random.random() if jitter else current_delay)
                         current_delay *= backoff
                     else:
                         msg = f"❌ {func.__name__} 最终失败: {e}"
@@ -91,14 +114,26 @@ class ColoredFormatter(logging.Formatter):
     }
     RESET = '\033[0m'
     
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 终端检测和带颜色的级别名只在构造时计算一次
+        self._tty = sys.stdout.isatty()  # 只在终端显示颜色
+        self._colored = {
+            level: f"{color}{level}{self.RESET}"
+            for level, color in self.COLORS.items()
+        }
+    
     def format(self, record):
-        # 添加颜色
-        if sys.stdout.isatty():  # 只在终端显示颜色
-            levelname = record.levelname
-            if levelname in self.COLORS:
-                record.levelname = f"{self.COLORS[levelname]}{levelname}{self.RESET}"
-                
-        return super().format(record)
+        if not self._tty:
+            return super().format(record)
+        
+        # 添加颜色（格式化后还原，避免颜色码带进其它 handler，如日志文件）
+        levelname = record.levelname
+        record.levelname = self._colored.get(levelname, levelname)
+        try:
+            return super().format(record)
+        finally:
+            record.levelname = levelname
 
 
 def setup_logger(
@@ -163,6 +198,62 @@ def setup_logger(
 # 3. 性能监控
 # ============================================
 
+@dataclass(slots=True)
+class _Stat:
+    """单个计时项的累计统计（Welford 在线算法，O(1) 内存；单位为纳秒）"""
+    n: int = 0
+    total: float = 0.0
+    mn: float = float('inf')
+    mx: float = 0.0
+    m2: float = 0.0  # 与均值差的平方和，用于方差
+    
+    def add(self, x: float):
+        mean = self.total / self.n if self.n else 0.0
+        self.n += 1
+        self.total += x
+        self.m2 += (x - mean) * (x - self.total / self.n)
+        if x < self.mn:
+            self.mn = x
+        if x > self.mx:
+            self.mx = x
+    
+    def combine(self, other: "_Stat"):
+        """合并另一组统计（Chan 并行公式）"""
+        if not other.n:
+            return
+        if not self.n:
+            self.n, self.total, self.mn, self.mx, self.m2 = (
+                other.n, other.total, other.mn, other.mx, other.m2
+            )
+            return
+        n = self.n + other.n
+        delta = other.total / other.n - self.total / self.n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+        self.total += other.total
+        self.mn = min(self.mn, other.mn)
+        self.mx = max(self.mx, other.mx)
+
+
+# 计时热路径上省去 time 模块的属性查找
+_perf_counter_ns = time.perf_counter_ns
+
+
+class _Timer:
+    """PerformanceMetrics.timer 返回的上下文管理器（纳秒计时，不走生成器协议）"""
+    __slots__ = ('stat', 'start')
+    
+    def __init__(self, stat: _Stat):
+        self.stat = stat
+        
+    def __enter__(self):
+        self.start = _perf_counter_ns()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.stat.add(_perf_counter_ns() - self.start)
+
+
 class PerformanceMetrics:
     """
     性能指标收集器
@@ -178,19 +269,20 @@ class PerformanceMetrics:
     """
     
     def __init__(self):
-        self.timings: Dict[str, List[float]] = defaultdict(list)
+        self.timings: Dict[str, _Stat] = defaultdict(_Stat)
         self.counters: Dict[str, int] = defaultdict(int)
         self.start_time = time.time()
         
-    @contextmanager
-    def timer(self, name: str):
+    def timer(self, name: str) -> "_Timer":
         """计时上下文管理器"""
-        start = time.time()
-        try:
-            yield
-        finally:
-            elapsed = time.time() - start
-            self.timings[name].append(elapsed)
+        return _Timer(self.timings[name])
+            
+    def merge(self, timings: Dict[str, _Stat], counters: Dict[str, int]):
+        """合并其他进程/实例收集的计时和计数"""
+        for name, stat in timings.items():
+            self.timings[name].combine(stat)
+        for name, value in counters.items():
+            self.counters[name] += value
             
     def increment(self, name: str, value: int = 1):
         """增加计数器"""
@@ -204,15 +296,16 @@ class PerformanceMetrics:
         """获取统计信息"""
         stats = {}
         
-        # 计时统计
-        for name, times in self.timings.items():
-            if times:
+        # 计时统计（纳秒 -> 秒）
+        for name, stat in self.timings.items():
+            if stat.n:
                 stats[name] = {
-                    'count': len(times),
-                    'total': sum(times),
-                    'avg': sum(times) / len(times),
-                    'min': min(times),
-                    'max': max(times)
+                    'count': stat.n,
+                    'total': stat.total / 1e9,
+                    'avg': stat.total / stat.n / 1e9,
+                    'min': stat.mn / 1e9,
+                    'max': stat.mx / 1e9,
+                    'std': (stat.m2 / stat.n) ** 0.5 / 1e9
                 }
         
         # 计数器
@@ -239,7 +332,7 @@ class PerformanceMetrics:
                 print(f"\n  {name}:")
                 print(f"    调用次数: {data['count']}")
                 print(f"    总时间: {data['total']:.2f}s")
-                print(f"    平均: {data['avg']:.3f}s")
+                print(f"    平均: {data['avg']:.3f}s (标准差 {data['std']:.3f}s)")
                 print(f"    范围: {data['min']:.3f}s - {data['max']:.3f}s")
         
         # 计数器
@@ -267,6 +360,14 @@ class DiskCache:
     """
     磁盘缓存系统（用于缓存 embedding）
     
+    所有条目存放在 cache_dir/cache.db 单个 SQLite 文件中（WAL 模式），
+    键为 16 字节 BLAKE2b 摘要；浮点向量存为 vector_dtype（float32/float16）原始字节，
+    带 8 字节头（dtype + 维度），其它值用 pickle。
+    旧版本的 MD5 键条目和 {md5}.pkl 文件在首次读取时自动迁移。
+    数据库前面有一层进程内 LRU（按摘要保存编码后的字节），重复文本不再查库。
+    写入由后台线程批量提交（write-behind），set 不阻塞调用方；
+    读取可见尚未落盘的写入，进程退出时自动 flush。
+    
     Example:
         cache = DiskCache("data/cache")
         
@@ -277,9 +378,72 @@ class DiskCache:
             cache.set(text, embedding)
     """
     
-    def __init__(self, cache_dir: str = "data/cache"):
+    DB_NAME = "cache.db"
+    # SQLite 单条语句的变量上限（旧版默认 999）
+    _MAX_VARS = 900
+    # 后台写线程：队列上限 / 每个事务最多写入条数
+    _WRITE_QUEUE_SIZE = 1000
+    _WRITE_BATCH = 256
+    # 值编码前缀：带头向量 / pickle
+    _VECTOR = b"V"
+    _PICKLE = b"P"
+    # 向量头：dtype 字符 + 3 字节填充 + uint32 维度
+    _VECTOR_HEADER = struct.Struct("<c3xI")
+    _VECTOR_DTYPES = {"float32": np.float32, "float16": np.float16}
+    
+    def __init__(
+        self,
+        cache_dir: str = "data/cache",
+        vector_dtype: str = "float32",
+        memory_size: int = 4096
+    ):
+        """
+        Args:
+            cache_dir: 缓存目录
+            vector_dtype: 向量存储精度；float16 体积减半，余弦检索几乎无损
+            memory_size: 进程内 LRU 条目数（0 关闭）；3072 维 float32 约 12KB/条
+        """
+        if vector_dtype not in self._VECTOR_DTYPES:
+            raise ValueError(f"不支持的 vector_dtype: {vector_dtype}")
+        self.vector_dtype = np.dtype(self._VECTOR_DTYPES[vector_dtype])
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.cache_dir / self.DB_NAME
+        # 启动时检查一次是否有旧版 .pkl 缓存，没有则未命中时不再逐键 stat
+        self._has_legacy_files = next(self.cache_dir.glob("*.pkl"), None) is not None
+        
+        self.memory_size = memory_size
+        self._memory: "OrderedDict[bytes, bytes]" = OrderedDict()
+        # 已入队但尚未提交的写入（与 LRU 共用锁）
+        self._pending: Dict[bytes, bytes] = {}
+        self._memory_lock = threading.Lock()
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.db_path), isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (k BLOB PRIMARY KEY, v BLOB NOT NULL)"
+        )
+        
+        self._write_q = queue.Queue(maxsize=self._WRITE_QUEUE_SIZE)
+        # 关闭后拒绝新写入；入队与发送结束标记在同一把锁下，结束标记之后不会再有条目
+        self._closed = False
+        self._close_lock = threading.Lock()
+        # 写线程只拿队列 / 连接 / 锁，不引用 self，缓存对象不再使用时可被回收
+        self._writer_thread = threading.Thread(
+            target=self._writer_loop,
+            args=(self._write_q, self._conn, self._lock, self._memory_lock, self._pending),
+            name="DiskCache-writer",
+            daemon=True,
+        )
+        self._writer_thread.start()
+        # 对象被回收或解释器退出时写完排队的数据并关闭连接
+        self._finalizer = weakref.finalize(
+            self, self._shutdown, self._write_q, self._writer_thread, self._conn, self._lock
+        )
         
     @staticmethod
     def _normalize_text(text: str) -> str:
@@ -291,56 +455,259 @@ class DiskCache:
             return ""
         return " ".join(str(text).split())
 
-    def _get_key(self, text: str, namespace: str = "") -> str:
-        """生成缓存键（命名空间 + 规范化文本）"""
+    def _cache_input(self, text: str, namespace: str = "") -> bytes:
         normalized = self._normalize_text(text)
         cache_input = f"{namespace}::{normalized}" if namespace else normalized
-        return hashlib.md5(cache_input.encode('utf-8')).hexdigest()
+        return cache_input.encode('utf-8')
+
+    def _get_key(self, text: str, namespace: str = "") -> bytes:
+        """生成缓存键（命名空间 + 规范化文本的 16 字节 BLAKE2b 摘要）"""
+        return hashlib.blake2b(self._cache_input(text, namespace), digest_size=16).digest()
+    
+    def _legacy_file(self, text: str, namespace: str = "") -> Path:
+        """旧版 {md5}.pkl 缓存文件路径，仅用于迁移"""
+        return self.cache_dir / f"{hashlib.md5(self._cache_input(text, namespace)).hexdigest()}.pkl"
+    
+    def _encode(self, value: Any) -> bytes:
+        """浮点向量存原始字节（float32 约为 pickle 列表的 1/2，float16 为 1/4），其它值 pickle"""
+        if isinstance(value, (list, tuple, np.ndarray)) and len(value) > 0:
+            try:
+                arr = np.asarray(value)
+            except ValueError:
+                arr = None
+            if arr is not None and arr.ndim == 1 and arr.dtype.kind == 'f':
+                header = self._VECTOR_HEADER.pack(self.vector_dtype.char.encode(), arr.shape[0])
+                return self._VECTOR + header + arr.astype(self.vector_dtype).tobytes()
+        return self._PICKLE + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    
+    @classmethod
+    def _decode(cls, blob: bytes) -> Any:
+        """解码缓存值；向量统一以 float32 精度的列表返回"""
+        kind, payload = blob[:1], blob[1:]
+        if kind == cls._VECTOR:
+            dtype_char, dim = cls._VECTOR_HEADER.unpack_from(payload)
+            vec = np.frombuffer(
+                payload, dtype=np.dtype(dtype_char.decode()),
+                count=dim, offset=cls._VECTOR_HEADER.size,
+            )
+            return vec.astype(np.float32).tolist()
+        return pickle.loads(payload)
+    
+    def _memory_get(self, key: bytes) -> Optional[bytes]:
+        with self._memory_lock:
+            blob = self._memory.get(key)
+            if blob is not None:
+                self._memory.move_to_end(key)
+                return blob
+            return self._pending.get(key)
+    
+    def _memory_put(self, key: bytes, blob: bytes):
+        if self.memory_size <= 0:
+            return
+        with self._memory_lock:
+            self._memory[key] = blob
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+    
+    def _load_legacy(self, key: bytes, legacy_file: Path) -> Optional[Any]:
+        """读取旧版 {md5}.pkl 缓存，并以新键迁移到数据库"""
+        if not legacy_file.exists():
+            return None
+        with open(legacy_file, 'rb') as f:
+            value = pickle.load(f)
+        self._put(key, value)
+        legacy_file.unlink()
+        return value
+    
+    def _check_open(self):
+        if self._closed:
+            raise RuntimeError("DiskCache 已关闭，不能再写入")
+    
+    def _enqueue(self, key: bytes, blob: bytes):
+        """交给后台线程写入；写入前的读取经 _pending 可见"""
+        with self._close_lock:
+            self._check_open()
+            with self._memory_lock:
+                self._pending[key] = blob
+            self._memory_put(key, blob)
+            self._write_q.put((key, blob))
+    
+    @classmethod
+    def _writer_loop(cls, write_q, conn, lock, memory_lock, pending):
+        """后台写线程：每次取出最多 _WRITE_BATCH 条，一个事务提交"""
+        stop = False
+        while not stop:
+            rows = [write_q.get()]
+            while len(rows) < cls._WRITE_BATCH:
+                try:
+                    rows.append(write_q.get_nowait())
+                except queue.Empty:
+                    break
+            if None in rows:
+                stop = True
+            items = [row for row in rows if row is not None]
+            try:
+                if items:
+                    with lock:
+                        conn.execute("BEGIN")
+                        try:
+                            conn.executemany(
+                                "INSERT OR REPLACE INTO kv (k, v) VALUES (?, ?)", items
+                            )
+                            conn.execute("COMMIT")
+                        except Exception:
+                            conn.execute("ROLLBACK")
+                            raise
+            except Exception as e:
+                print(f"⚠️  缓存写入失败: {e}")
+            finally:
+                with memory_lock:
+                    for key, blob in items:
+                        if pending.get(key) is blob:
+                            del pending[key]
+                for _ in rows:
+                    write_q.task_done()
+    
+    @staticmethod
+    def _shutdown(write_q, writer_thread, conn, lock):
+        """发送结束标记，等写线程提交完剩余条目后关闭连接"""
+        write_q.put(None)
+        writer_thread.join()
+        with lock:
+            conn.close()
+    
+    def flush(self):
+        """等待所有排队的写入提交完成"""
+        if self._writer_thread.is_alive():
+            self._write_q.join()
+    
+    def _put(self, key: bytes, value: Any):
+        blob = self._encode(value)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (k, v) VALUES (?, ?)", (key, blob)
+            )
+        self._memory_put(key, blob)
         
     def get(self, text: str, namespace: str = "") -> Optional[Any]:
         """获取缓存"""
         key = self._get_key(text, namespace=namespace)
-        cache_file = self.cache_dir / f"{key}.pkl"
         
-        if cache_file.exists():
-            try:
-                with open(cache_file, 'rb') as f:
-                    return pickle.load(f)
-            except Exception as e:
-                print(f"⚠️  缓存读取失败: {e}")
+        try:
+            blob = self._memory_get(key)
+            if blob is not None:
+                return self._decode(blob)
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT v FROM kv WHERE k = ?", (key,)
+                ).fetchone()
+            if row is not None:
+                self._memory_put(key, row[0])
+                return self._decode(row[0])
+            if not self._has_legacy_files:
                 return None
-                
-        return None
+            return self._load_legacy(key, self._legacy_file(text, namespace=namespace))
+        except Exception as e:
+            print(f"⚠️  缓存读取失败: {e}")
+            return None
         
     def set(self, text: str, value: Any, namespace: str = ""):
-        """设置缓存"""
+        """设置缓存（后台线程写入）"""
+        self._check_open()
         key = self._get_key(text, namespace=namespace)
-        cache_file = self.cache_dir / f"{key}.pkl"
         
         try:
-            with open(cache_file, 'wb') as f:
-                pickle.dump(value, f)
+            self._enqueue(key, self._encode(value))
+        except Exception as e:
+            print(f"⚠️  缓存写入失败: {e}")
+            
+    def get_many(self, texts: List[str], namespace: str = "") -> Dict[str, Any]:
+        """批量获取缓存（每 900 个键一次查询），返回命中的 {text: value}"""
+        key_to_texts = defaultdict(list)
+        for text in dict.fromkeys(texts):
+            key_to_texts[self._get_key(text, namespace=namespace)].append(text)
+        
+        found = {}
+        try:
+            # 先查进程内 LRU，剩余的再查库
+            keys = []
+            for key, group in list(key_to_texts.items()):
+                blob = self._memory_get(key)
+                if blob is None:
+                    keys.append(key)
+                    continue
+                value = self._decode(blob)
+                for text in group:
+                    found[text] = value
+                del key_to_texts[key]
+            
+            with self._lock:
+                rows = []
+                for i in range(0, len(keys), self._MAX_VARS):
+                    part = keys[i:i + self._MAX_VARS]
+                    rows.extend(self._conn.execute(
+                        f"SELECT k, v FROM kv WHERE k IN ({','.join('?' * len(part))})",
+                        part,
+                    ))
+            for key, blob in rows:
+                self._memory_put(key, blob)
+                value = self._decode(blob)
+                for text in key_to_texts.pop(key):
+                    found[text] = value
+            # 未命中的再尝试旧版缓存（只有启动时存在 .pkl 文件才检查）
+            for key, missing in (key_to_texts.items() if self._has_legacy_files else ()):
+                value = self._load_legacy(key, self._legacy_file(missing[0], namespace=namespace))
+                if value is not None:
+                    for text in missing:
+                        found[text] = value
+        except Exception as e:
+            print(f"⚠️  缓存读取失败: {e}")
+        return found
+    
+    def set_many(self, items: Dict[str, Any], namespace: str = ""):
+        """批量设置缓存（后台线程按批提交）"""
+        self._check_open()
+        try:
+            for text, value in items.items():
+                self._enqueue(self._get_key(text, namespace=namespace), self._encode(value))
         except Exception as e:
             print(f"⚠️  缓存写入失败: {e}")
             
     def clear(self):
-        """清除所有缓存"""
-        count = 0
+        """清除所有缓存（包括旧版 .pkl 文件）"""
+        self.flush()
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+            self._conn.execute("DELETE FROM kv")
+            self._conn.execute("VACUUM")
+        with self._memory_lock:
+            self._memory.clear()
         for cache_file in self.cache_dir.glob("*.pkl"):
             cache_file.unlink()
             count += 1
-        print(f"✅ 已清除 {count} 个缓存文件")
+        self._has_legacy_files = False
+        print(f"✅ 已清除 {count} 个缓存条目")
         
     def size(self) -> int:
         """获取缓存大小（字节）"""
-        total_size = 0
-        for cache_file in self.cache_dir.glob("*.pkl"):
-            total_size += cache_file.stat().st_size
-        return total_size
+        self.flush()
+        with self._lock:
+            page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        return page_count * page_size
         
     def count(self) -> int:
-        """获取缓存文件数量"""
-        return len(list(self.cache_dir.glob("*.pkl")))
+        """获取缓存条目数量"""
+        self.flush()
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+    
+    def close(self):
+        """写完排队的数据并关闭数据库连接（可重复调用）；之后的写入会抛出 RuntimeError"""
+        with self._close_lock:
+            self._closed = True
+        self._finalizer()
         
     def stats(self):
         """打印缓存统计"""
@@ -349,10 +716,88 @@ class DiskCache:
         size_mb = size / (1024 * 1024)
         
         print(f"📦 缓存统计:")
-        print(f"   文件数: {count:,}")
+        print(f"   条目数: {count:,}")
         print(f"   总大小: {size_mb:.2f} MB")
 
 
+class ChunkCache:
+    """
+    文档处理结果缓存（与 DiskCache 共用 cache_dir/cache.db 的 chunks 表）
+    
+    按 (文件内容哈希, 处理参数哈希) 保存分块和元数据，
+    未修改的文件可跳过 加载 / 清洗 / 分块。
+    
+    Example:
+        chunk_cache = ChunkCache("data/cache")
+        result = chunk_cache.get(file_hash, params_hash)
+        if result is None:
+            result = process(file_path)
+            chunk_cache.set(file_hash, params_hash, result)
+    """
+    
+    def __init__(self, cache_dir: str = "data/cache"):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.cache_dir / DiskCache.DB_NAME
+        
+        self._lock = threading.Lock()
+        # 多进程处理时各进程各自写入，等待锁而不是立即报错
+        self._conn = sqlite3.connect(
+            str(self.db_path), isolation_level=None, check_same_thread=False, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "file_hash BLOB NOT NULL, params_hash BLOB NOT NULL, chunks_json BLOB NOT NULL, "
+            "PRIMARY KEY (file_hash, params_hash))"
+        )
+    
+    @staticmethod
+    def params_hash(params: Any) -> bytes:
+        """处理参数（可 JSON 序列化）的 16 字节摘要"""
+        encoded = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.blake2b(encoded.encode('utf-8'), digest_size=16).digest()
+        
+    def get(self, file_hash: str, params_hash: bytes) -> Optional[Any]:
+        """获取缓存"""
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT chunks_json FROM chunks WHERE file_hash = ? AND params_hash = ?",
+                    (bytes.fromhex(file_hash), params_hash)
+                ).fetchone()
+            return json.loads(row[0]) if row is not None else None
+        except Exception as e:
+            print(f"⚠️  分块缓存读取失败: {e}")
+            return None
+        
+    def set(self, file_hash: str, params_hash: bytes, value: Any):
+        """设置缓存"""
+        try:
+            blob = json.dumps(value, ensure_ascii=False).encode('utf-8')
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO chunks (file_hash, params_hash, chunks_json) "
+                    "VALUES (?, ?, ?)",
+                    (bytes.fromhex(file_hash), params_hash, blob)
+                )
+        except Exception as e:
+            print(f"⚠️  分块缓存写入失败: {e}")
+    
+    def clear(self):
+        """清除所有分块缓存"""
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            self._conn.execute("DELETE FROM chunks")
+        print(f"✅ 已清除 {count} 个分块缓存条目")
+    
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
 # ============================================
 # 5. 批处理工具
 # ============================================
@@ -381,6 +826,32 @@ def batch_iterator(
         yield items[i:i + batch_size]
 
 
+def _iter_files(directory: Path, recursive: bool = True) -> Iterator[Path]:
+    """
+    按名称排序遍历目录下的文件（跟随符号链接，跳过已访问过的真实目录以防循环），
+    顺序确定且无需先收集全部文件
+    """
+    if not recursive:
+        with os.scandir(directory) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_file())
+        for name in names:
+            yield Path(directory, name)
+        return
+
+    visited = set()
+    for root, dirs, names in os.walk(directory, followlinks=True):
+        real_root = os.path.realpath(root)
+        if real_root in visited:
+            dirs[:] = []
+            continue
+        visited.add(real_root)
+        dirs.sort()
+        for name in sorted(names):
+            file_path = Path(root, name)
+            if file_path.is_file():
+                yield file_path
+
+
 def file_batch_iterator(
     directory: Path,
     file_extensions: List[str],
@@ -403,23 +874,26 @@ def file_batch_iterator(
         for file_batch in file_batch_iterator(Path("documents/"), ['.pdf', '.txt']):
             process_files(file_batch)
     """
-    files = []
     seen = set()
+    ext_set = {ext.lower() for ext in file_extensions}
 
-    for ext in sorted(file_extensions):
-        iterator = directory.rglob(f"*{ext}") if recursive else directory.glob(f"*{ext}")
-        for file_path in iterator:
-            if not file_path.is_file():
+    def matching_files() -> Iterator[Path]:
+        # 一次目录遍历按扩展名集合过滤，而不是每个扩展名各 glob 一遍
+        for file_path in _iter_files(directory, recursive):
+            if os.path.splitext(file_path.name)[1].lower() not in ext_set:
                 continue
             normalized = str(file_path.resolve())
             if normalized in seen:
                 continue
             seen.add(normalized)
-            files.append(file_path)
+            yield file_path
 
-    files.sort(key=lambda p: str(p.resolve()))
-    
-    for batch in batch_iterator(files, batch_size):
+    # 边遍历边产出批次，不预先收集整个目录树
+    files = matching_files()
+    while True:
+        batch = list(islice(files, batch_size))
+        if not batch:
+            return
         yield batch
 
 
@@ -460,6 +934,12 @@ def show_progress(
 # 7. 文件操作工具
 # ============================================
 
+# 文件名中不安全字符（含 \x00-\x1f 控制字符） -> '_'
+_SAFE_FILENAME_TABLE = str.maketrans(
+    {c: '_' for c in '<>:"/\\|?*' + ''.join(map(chr, range(0x20)))}
+)
+
+
 def safe_filename(filename: str, max_length: int = 255) -> str:
     """
     生成安全的文件名
@@ -472,8 +952,7 @@ def safe_filename(filename: str, max_length: int = 255) -> str:
         安全的文件名
     """
     # 移除不安全字符
-    import re
-    filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
+    filename = filename.translate(_SAFE_FILENAME_TABLE)
     
     # 限制长度
     if len(filename) > max_length:
@@ -486,21 +965,37 @@ def safe_filename(filename: str, max_length: int = 255) -> str:
 
 def get_file_hash(filepath: Path) -> str:
     """
-    计算文件 MD5 哈希
+    计算文件内容哈希（16 字节，hex）
+    
+    已安装 blake3 时使用 BLAKE3（SIMD 加速），否则使用 BLAKE2b；
+    两者结果不同，持久化时请连同 FILE_HASH_ALGORITHM 一起记录。
     
     Args:
         filepath: 文件路径
         
     Returns:
-        MD5 哈希值
+        32 位十六进制哈希值
     """
-    md5 = hashlib.md5()
+    if HAS_BLAKE3:
+        hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+        hasher.update_mmap(str(filepath))
+        return hasher.hexdigest(length=16)
     
+    hasher = hashlib.blake2b(digest_size=16)
     with open(filepath, 'rb') as f:
-        for chunk in iter(lambda: f.read(8192), b''):
-            md5.update(chunk)
+        file_size = os.fstat(f.fileno()).st_size
+        # 映射整个文件一次性交给哈希；空文件无法 mmap，32 位平台上的超大文件退回分块读取
+        if 0 < file_size < sys.maxsize:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                hasher.update(mm)
+        else:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                hasher.update(chunk)
             
-    return md5.hexdigest()
+    return hasher.hexdigest()
+
+
+_BYTE_UNITS = ("B", "KB", "MB", "GB", "TB", "PB")
 
 
 def format_bytes(size: int) -> str:
@@ -513,11 +1008,10 @@ def format_bytes(size: int) -> str:
     Returns:
         格式化后的字符串（如 "1.5 MB"）
     """
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if size < 1024.0:
-            return f"{size:.2f} {unit}"
-        size /= 1024.0
-    return f"{size:.2f} PB"
+    # 单位序号 = floor(log2(size) / 10)，由 bit_length 直接得到，无需逐级除
+    whole = int(size)
+    unit = min((whole.bit_length() - 1) // 10, len(_BYTE_UNITS) - 1) if whole > 0 else 0
+    return f"{size / (1 << (10 * unit)):.2f} {_BYTE_UNITS[unit]}"
 
 
 # ============================================
@@ -525,53 +1019,89 @@ def format_bytes(size: int) -> str:
 # ============================================
 
 if __name__ == "__main__":
-    # 1. 日志系统
+    # 1. 日志系统（经 QueueHandler 入队，由后台 QueueListener 写控制台/文件）
+    from logging.handlers import QueueHandler, QueueListener
+    
     logger = setup_logger("TestApp", "INFO", "logs/test.log")
+    log_queue = queue.Queue(-1)
+    handlers = logger.handlers[:]
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    
     logger.info("✅ 日志系统测试")
     logger.warning("⚠️  警告测试")
     logger.error("❌ 错误测试")
     
-    # 2. 性能监控
-    metrics = PerformanceMetrics()
+    # 2-6 的输出先写入内存缓冲，结束时一次写出（日志仍由 QueueListener 直接输出）
+    from contextlib import redirect_stdout
+    import io
+    
+    out = io.StringIO()
+    with redirect_stdout(out):
+        # 2. 性能监控（忙等固定时长，计时结果不受调度器唤醒抖动影响）
+        def _spin_ns(ns: int):
+            end = time.perf_counter_ns() + ns
+            while time.perf_counter_ns() < end:
+                pass
     
-    with metrics.timer('task1'):
-        time.sleep(0.1)
+        metrics = PerformanceMetrics()
+    
+        with metrics.timer('task1'):
+            _spin_ns(100_000_000)
         
-    with metrics.timer('task2'):
-        time.sleep(0.2)
+        with metrics.timer('task2'):
+            _spin_ns(200_000_000)
         
-    metrics.increment('processed', 100)
-    metrics.print_stats()
+        metrics.increment('processed', 100)
+        metrics.print_stats()
     
-    # 3. 缓存系统
-    cache = DiskCache("data/test_cache")
-    cache.set("test_key", {"data": "value"})
-    result = cache.get("test_key")
-    print(f"缓存结果: {result}")
-    cache.stats()
-    cache.clear()
+        # 3. 缓存系统
+        cache = DiskCache("data/test_cache")
+        cache.set("test_key", {"data": "value"})
+        result = cache.get("test_key")
+        print(f"缓存结果: {result}")
+        cache.stats()
+        cache.clear()
     
-    # 4. 重试机制
-    @retry_on_failure(max_retries=3, delay=0.5, logger=logger)
-    def unstable_function():
-        import random
-        if random.random() < 0.7:
-            raise Exception("随机失败")
-        return "成功"
+        # 4. 重试机制（指数退避 + full jitter）
+        @retry_on_failure(max_retries=3, delay=0.1, jitter=True, logger=logger)
+        def unstable_function():
+            if random.random() < 0.7:
+                raise Exception("随机失败")
+            return "成功"
     
-    try:
-        result = unstable_function()
-        print(f"重试结果: {result}")
-    except Exception as e:
-        print(f"最终失败: {e}")
+        try:
+            result = unstable_function()
+            print(f"重试结果: {result}")
+        except Exception as e:
+            print(f"最终失败: {e}")
     
-    # 5. 批处理
-    items = list(range(100))
-    for i, batch in enumerate(batch_iterator(items, 32)):
-        print(f"批次 {i+1}: {len(batch)} 项")
+        # 5. 批处理（数值数据用 NumPy 切片，每批是原数组的视图，不复制数据）
+        arr = np.arange(100)
+        for i, start in enumerate(range(0, arr.size, 32)):
+            batch = arr[start:start + 32]
+            print(f"批次 {i+1}: {batch.size} 项")
+        
+        # 非数值的惰性数据（生成器）用 islice 逐批取出，复用同一个缓冲列表
+        it = (f"item-{n}" for n in range(100))
+        buf = []
+        i = 0
+        while True:
+            buf.clear()
+            buf.extend(islice(it, 32))
+            if not buf:
+                break
+            print(f"惰性批次 {i+1}: {len(buf)} 项")
+            i += 1
     
-    # 6. 文件工具
-    print(f"安全文件名: {safe_filename('test<file>name?.txt')}")
-    print(f"格式化大小: {format_bytes(1536000)}")
+        # 6. 文件工具
+        print(f"安全文件名: {safe_filename('test<file>name?.txt')}")
+        print(f"格式化大小: {format_bytes(1536000)}")
     
-    print("\n✅ 所有工具测试完成！")
+    listener.stop()
+    out.write("\n✅ 所有工具测试完成！\n")
+    sys.stdout.write(out.getvalue())
+    sys.stdout.flush()
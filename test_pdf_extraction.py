@@ -1,36 +1,355 @@
-from pypdf import PdfReader
+import argparse
+import atexit
+import mmap
+import os
+import stat
 import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
 
-if len(sys.argv) < 2:
-    print("用法: python test_pdf_extraction.py your_paper.pdf")
-    sys.exit(1)
+PROJECT_ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(PROJECT_ROOT / "src"))
 
-pdf_path = sys.argv[1]
+from utils.helpers import DiskCache, get_file_hash
 
 try:
-    reader = PdfReader(pdf_path)
-    
-    print(f"📄 PDF 信息:")
-    print(f"   页数: {len(reader.pages)}")
-    print(f"   标题: {reader.metadata.title if reader.metadata else 'N/A'}")
-    
-    # 提取前 2 页的文本
-    print(f"\n📝 前 2 页文本预览:\n")
-    print("="*60)
-    
-    for i, page in enumerate(reader.pages[:2], 1):
-        text = page.extract_text()
-        print(f"\n--- 第 {i} 页 ---")
-        print(text[:1300])
-        print("...")
-        print(f"(共 {len(text)} 字符)")
-    
-    print("\n" + "="*60)
-    print("\n💡 观察:")
-    print("  • 文本是否完整？")
-    print("  • 数学公式是否可读？")
-    print("  • 布局是否混乱？")
-    print("  • 是否有大量乱码？")
-    
-except Exception as e:
-    print(f"❌ 提取失败: {e}")
+    import pytesseract
+    from PIL import Image
+    HAS_OCR = True
+except ImportError:
+    HAS_OCR = False
+
+# 抽取结果按 (后端, 文件内容哈希, 页号) 缓存，反复预览同一文件时跳过解析
+PDF_TEXT_CACHE_DIR = PROJECT_ROOT / "data/pdf_text_cache"
+# 抽取方式变化时递增，使旧缓存失效
+PDF_TEXT_CACHE_VERSION = 3
+
+# 可选后端（环境变量 RAG_PDF_BACKEND 指定）：
+#   pymupdf   - MuPDF C 引擎，最快（未指定时优先使用）
+#   pypdfium2 - PDFium C++ 引擎
+#   pypdf     - 纯 Python，兼容性基线（requirements.txt 默认依赖）
+BACKENDS = ("pypdf", "pymupdf", "pypdfium2")
+# --preview 使用的快速后端：playa 惰性解释内容流，只解码文字对象（跳过图形状态/图像等操作符）
+PREVIEW_BACKEND = "playa"
+
+
+# PyMuPDF 文本块 y0 相差不超过该值（pt）视为同一行
+BLOCK_LINE_TOLERANCE = 5.0
+
+# 已打开文档池的容量（LRU，超出时关闭最久未用的文档）
+DOC_POOL_SIZE = 32
+
+
+# --ocr-fallback：去掉空白后少于该字符数的页视为没有文字层，栅格化后 OCR
+OCR_MIN_CHARS = 50
+OCR_DPI = 200
+
+
+# 少于该页数时串行抽取（进程启动 + 各自打开文档的开销比抽取本身大）
+PARALLEL_MIN_PAGES = 8
+
+
+def _import_pymupdf():
+    try:
+        import pymupdf
+    except ImportError:
+        import fitz as pymupdf  # PyMuPDF < 1.24 的模块名
+    return pymupdf
+
+
+def default_backend() -> str:
+    try:
+        _import_pymupdf()
+        return "pymupdf"
+    except ImportError:
+        return "pypdf"
+
+
+def _reading_order(blocks, tolerance: float = BLOCK_LINE_TOLERANCE):
+    """按 y0 分行（与行首块 y0 相差不超过 tolerance 视为同一行），行内按 x0 排序"""
+    lines = []
+    for block in sorted(blocks, key=lambda b: b[1]):
+        if lines and block[1] - lines[-1][0][1] <= tolerance:
+            lines[-1].append(block)
+        else:
+            lines.append([block])
+    return [block for line in lines for block in sorted(line, key=lambda b: b[0])]
+
+
+class PdfDocument:
+    """对各后端文档对象的薄封装：页数 / 标题 / 单页文本"""
+
+    def __init__(self, path: str, backend: str):
+        self.backend = backend
+        self._mmap = None
+        if backend == "pymupdf":
+            self._doc = _import_pymupdf().open(path)
+            self.page_count = self._doc.page_count
+        elif backend == "pypdfium2":
+            import pypdfium2 as pdfium
+            self._doc = pdfium.PdfDocument(path)
+            self.page_count = len(self._doc)
+        elif backend == "playa":
+            import playa
+            self._doc = playa.open(path)
+            self.page_count = len(self._doc.pages)
+        else:
+            from pypdf import PdfReader
+            # pypdf 解析 xref 时大量小块随机读取；直接在只读 mmap 上解析，
+            # 由内核按页调入，不经用户态缓冲复制（空文件无法 mmap，退回按路径打开）
+            source = path
+            if os.path.getsize(path) > 0:
+                with open(path, "rb") as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                source = self._mmap
+            self._doc = PdfReader(source)
+            # 取一次页列表，之后按下标取单页（reader.pages 每次访问都新建列表视图）
+            self._pages = self._doc.pages
+            self.page_count = len(self._pages)
+
+    @property
+    def title(self):
+        if self.backend == "pymupdf":
+            return self._doc.metadata.get("title") if self._doc.metadata else None
+        if self.backend == "pypdfium2":
+            return self._doc.get_metadata_dict().get("Title")
+        if self.backend == "playa":
+            from playa.pdftypes import resolve1
+            from playa.utils import decode_text
+            info = resolve1(self._doc.trailer.get("Info")) or {}
+            title = resolve1(info.get("Title"))
+            return decode_text(title) if isinstance(title, bytes) else title
+        # 只取 /Info 里的 /Title，不经 reader.metadata 构造整个 DocumentInformation
+        try:
+            title = self._doc.trailer["/Info"].get_object().get("/Title")
+        except KeyError:
+            return None
+        return title.get_object() if title is not None else None
+
+    def page_text(self, i: int) -> str:
+        if self.backend == "pymupdf":
+            # 取文本块自行排序，不走 "text" 模式的阅读顺序重排；
+            # 分栏是否错乱在输出里直接可见（block_type 1 为图片块，跳过）
+            blocks = [b for b in self._doc.load_page(i).get_text("blocks") if b[6] == 0]
+            return "\n".join(b[4].rstrip("\n") for b in _reading_order(blocks))
+        if self.backend == "pypdfium2":
+            textpage = self._doc[i].get_textpage()
+            try:
+                return textpage.get_text_range()
+            finally:
+                textpage.close()
+        if self.backend == "playa":
+            return "".join(obj.chars for obj in self._doc.pages[i].texts)
+        return self._pages[i].extract_text()
+
+    def close(self):
+        if self.backend != "pypdf":
+            self._doc.close()
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# 已打开的文档按 (路径, 后端, 修改时间) 复用：同一文件反复取页时只解析一次 xref / 页树
+_doc_pool: "OrderedDict[tuple, PdfDocument]" = OrderedDict()
+
+
+def _open_document(path: str, backend: str) -> PdfDocument:
+    """从文档池取已打开的文档，没有则打开并放入池中"""
+    path = os.path.abspath(path)
+    key = (path, backend, os.stat(path).st_mtime_ns)
+    doc = _doc_pool.get(key)
+    if doc is not None:
+        _doc_pool.move_to_end(key)
+        return doc
+    doc = PdfDocument(path, backend)
+    _doc_pool[key] = doc
+    while len(_doc_pool) > DOC_POOL_SIZE:
+        _, evicted = _doc_pool.popitem(last=False)
+        evicted.close()
+    return doc
+
+
+@atexit.register
+def _close_documents():
+    while _doc_pool:
+        _, doc = _doc_pool.popitem(last=False)
+        doc.close()
+
+
+def get_page(path: str, i: int, backend: str = None) -> str:
+    """取第 i 页（从 0 开始）文本，复用文档池中已打开的文档"""
+    return _open_document(path, backend or default_backend()).page_text(i)
+
+
+def ocr_page(path: str, i: int, dpi: int = OCR_DPI) -> str:
+    """用 PyMuPDF 把第 i 页（从 0 开始）栅格化后交给 Tesseract 识别"""
+    page = _open_document(path, "pymupdf")._doc.load_page(i)
+    pix = page.get_pixmap(dpi=dpi, alpha=False)
+    return pytesseract.image_to_string(
+        Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    )
+
+
+# fork 出的子进程继承的父进程文档（与父进程共享文件描述符和读取偏移）
+_inherited_docs = []
+
+
+def _init_extract_worker():
+    """子进程初始化：丢弃继承的文档池，让子进程各自重新打开文件。
+    继承的文档只挪走、不关闭（关闭会在共享的文件上做清理）"""
+    _inherited_docs.extend(_doc_pool.values())
+    _doc_pool.clear()
+
+
+def _extract_indices(path: str, backend: str, indices):
+    """子进程：各自打开文档（文档对象不可跨进程传递），抽取一段页"""
+    doc = _open_document(path, backend)
+    return [doc.page_text(i) for i in indices]
+
+
+def _iter_page_texts(path: str, backend: str, n: int, cache: DiskCache, key_prefix: str):
+    """逐页产出文本（先查缓存）；下游停止迭代后不再解析后续页"""
+    for i in range(n):
+        text = cache.get(f"{key_prefix}:{i}") if cache else None
+        if text is None:
+            text = _open_document(path, backend).page_text(i)
+            if cache:
+                cache.set(f"{key_prefix}:{i}", text)
+        yield text
+
+
+def extract_pages(path: str, backend: str, n: int, workers: int = None,
+                  cache: DiskCache = None, lazy: bool = False):
+    """
+    抽取前 n 页文本；页数较多时按连续页段分给多个进程并行抽取
+
+    Args:
+        lazy: 为 True 时不预先抽取，返回逐页抽取的生成器（串行）
+
+    Returns:
+        (总页数, 标题, 文本列表或生成器)
+    """
+    key_prefix = f"v{PDF_TEXT_CACHE_VERSION}:{backend}:{get_file_hash(path)}" if cache else None
+    info = cache.get(f"{key_prefix}:info") if cache else None
+    texts = {}
+
+    if info is None:
+        doc = _open_document(path, backend)
+        info = (doc.page_count, doc.title)
+        if cache:
+            cache.set(f"{key_prefix}:info", info)
+    page_count, title = info
+    n = min(n, page_count)
+    if lazy:
+        return page_count, title, _iter_page_texts(path, backend, n, cache, key_prefix)
+
+    if cache:
+        cached = cache.get_many([f"{key_prefix}:{i}" for i in range(n)])
+        for i in range(n):
+            text = cached.get(f"{key_prefix}:{i}")
+            if text is not None:
+                texts[i] = text
+    missing = [i for i in range(n) if i not in texts]
+
+    workers = min(workers or os.cpu_count() or 1, len(missing))
+    if missing and (len(missing) < PARALLEL_MIN_PAGES or workers <= 1):
+        doc = _open_document(path, backend)
+        texts.update((i, doc.page_text(i)) for i in missing)
+    elif missing:
+        bounds = [len(missing) * k // workers for k in range(workers + 1)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_extract_worker) as executor:
+            parts = executor.map(
+                _extract_indices, repeat(path), repeat(backend),
+                (missing[a:b] for a, b in zip(bounds, bounds[1:]))
+            )
+            texts.update(zip(missing, (text for part in parts for text in part)))
+
+    if cache and missing:
+        cache.set_many({f"{key_prefix}:{i}": texts[i] for i in missing})
+    return page_count, title, [texts[i] for i in range(n)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="PDF 文本抽取预览",
+        epilog=f"RAG_PDF_BACKEND={{{','.join(BACKENDS)}}} 选择解析后端"
+    )
+    parser.add_argument("pdf_path", help="PDF 文件路径")
+    parser.add_argument("--pages", type=int, default=2, help="预览页数（默认 2）")
+    parser.add_argument("--workers", type=int, default=None, help="并行进程数（默认 CPU 核数）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用抽取结果缓存")
+    parser.add_argument(
+        "--preview", action="store_true",
+        help=f"快速预览：用 {PREVIEW_BACKEND} 只解码文字对象（忽略 RAG_PDF_BACKEND）"
+    )
+    parser.add_argument(
+        "--ocr-fallback", action="store_true",
+        help=f"文本少于 {OCR_MIN_CHARS} 字符的页（扫描件）改用 OCR（需要 pytesseract + Pillow + PyMuPDF）"
+    )
+    args = parser.parse_args()
+
+    pdf_path = args.pdf_path
+    backend = os.environ.get("RAG_PDF_BACKEND", "").strip().lower() or default_backend()
+    if args.preview:
+        backend = PREVIEW_BACKEND
+    elif backend not in BACKENDS:
+        print(f"❌ 未知的 RAG_PDF_BACKEND: {backend}（可选: {', '.join(BACKENDS)}）")
+        sys.exit(1)
+
+    if args.ocr_fallback:
+        try:
+            _import_pymupdf()
+        except ImportError:
+            HAS_OCR = False
+        if not HAS_OCR:
+            print("⚠️  --ocr-fallback 需要 pytesseract、Pillow 和 PyMuPDF，已忽略")
+            args.ocr_fallback = False
+
+    # 输出到管道（如 | head）时逐页抽取并立即写出，下游关闭后不再解析后续页；
+    # 终端和重定向到文件（> out.txt）仍走并行 + 批量缓存
+    lazy = stat.S_ISFIFO(os.fstat(sys.stdout.fileno()).st_mode)
+
+    try:
+        cache = None if args.no_cache else DiskCache(str(PDF_TEXT_CACHE_DIR))
+        page_count, title, pages_text = extract_pages(
+            pdf_path, backend, args.pages, args.workers, cache=cache, lazy=lazy
+        )
+
+        print(f"📄 PDF 信息:")
+        print(f"   页数: {page_count}")
+        print(f"   标题: {title or 'N/A'}")
+        print(f"   后端: {backend}")
+
+        # 提取前 N 页的文本
+        print(f"\n📝 前 {min(args.pages, page_count)} 页文本预览:\n")
+        print("="*60)
+
+        for i, text in enumerate(pages_text, 1):
+            # 只在几乎没有文字时才付 OCR 的代价，有文字层的页不受影响
+            if args.ocr_fallback and len(text.strip()) < OCR_MIN_CHARS:
+                text = ocr_page(pdf_path, i - 1)
+            # 只有超长时才截断；每页拼成一次写出
+            preview = text if len(text) <= 1300 else text[:1300] + "\n..."
+            print(f"\n--- 第 {i} 页 ---\n{preview}\n(共 {len(text)} 字符)", flush=lazy)
+
+        print("\n" + "="*60)
+        print("\n💡 观察:")
+        print("  • 文本是否完整？")
+        print("  • 数学公式是否可读？")
+        print("  • 布局是否混乱？")
+        print("  • 是否有大量乱码？")
+
+    except BrokenPipeError:
+        # 下游已关闭：把 stdout 指向 devnull，避免退出时刷新缓冲再次报错
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ 提取失败: {e}")